@@ -3,14 +3,169 @@ Batch Paper Downloader
 
 This script searches PubMed/PMC for multiple terms and downloads the top k papers for each term.
 Supports both PubMed and PMC search methods.
+
+Set NCBI_API_KEY (and NCBI_EMAIL) in the environment, or pass api_key/email, to
+identify the batch to NCBI and unlock the 10 requests/second tier.
 """
 
-from paper_downloader import download_pmc_papers, download_pubmed_free_fulltext_papers
+from paper_downloader import (
+    NCBI_TOOL,
+    JsonCache,
+    create_session,
+    download_pmc_papers,
+    download_pmc_papers_http,
+    download_pubmed_free_fulltext_papers,
+    is_retriable_error,
+    launch_browser,
+    logger as paper_logger,
+)
+import atexit
+import contextlib
+import hashlib
+import json
+import logging
 import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from playwright.sync_api import sync_playwright
+
+
+# Progress lines go through logging; handlers are attached on the first batch
+logger = logging.getLogger("batch_downloader")
+
+LOG_PATH = "batch.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_log_listener = None
+_log_setup_lock = threading.Lock()
+
+
+class _MessageFormatter(logging.Formatter):
+    """Console formatter: just the message, leaving tracebacks to the log file."""
+    
+    def format(self, record):
+        return record.getMessage()
+
+
+class _LocalQueueHandler(QueueHandler):
+    """Enqueue records as-is so each listener handler applies its own formatter."""
+    
+    def prepare(self, record):
+        return record
+
+
+def _setup_logging():
+    """
+    Route the batch and paper_downloader loggers through a queue to stdout and a
+    rotating log file.
+    
+    Workers only enqueue records; a background listener thread does the console
+    and file I/O. Does nothing if the logger already has handlers or the application
+    has configured the root logger, whose handlers then receive both loggers' records.
+    """
+    global _log_listener
+    with _log_setup_lock:
+        if logger.handlers or logging.getLogger().handlers:
+            return
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(_MessageFormatter())
+        file_handler = RotatingFileHandler(
+            LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+        
+        log_queue = queue.Queue()
+        _log_listener = QueueListener(log_queue, console_handler, file_handler)
+        _log_listener.start()
+        # Stopping drains the queue, so nothing logged before exit is lost
+        atexit.register(_log_listener.stop)
+        
+        queue_handler = _LocalQueueHandler(log_queue)
+        for batch_logger in (logger, paper_logger):
+            # Drop paper_downloader's default stdout buffer so its lines aren't printed twice
+            for handler in list(batch_logger.handlers):
+                batch_logger.removeHandler(handler)
+                handler.close()
+            batch_logger.addHandler(queue_handler)
+            batch_logger.setLevel(logging.INFO)
+            batch_logger.propagate = False
+
+# One pooled session shared by every term so connections to NCBI stay warm
+SESSION = create_session()
+atexit.register(SESSION.close)
+
+
+_UNSAFE_DIRNAME_RE = re.compile(r'[^a-z0-9._-]+')
+# Terms made only of these map to a directory name without losing anything but case
+_PLAIN_TERM_RE = re.compile(r'[a-z0-9][a-z0-9 .-]*')
+_MAX_DIRNAME_LENGTH = 200
+# Device names Windows refuses as file or directory names
+_RESERVED_DIRNAMES = {"CON", "PRN", "AUX", "NUL", *(f"COM{i}" for i in range(1, 10)), *(f"LPT{i}" for i in range(1, 10))}
+
+
+def _term_dirname(term):
+    """
+    Map a search term to a filesystem-safe subdirectory name that depends on the term alone.
+    
+    The term is lowercased (PubMed searches are case-insensitive, so case variants
+    share a directory) and its spaces become "_", e.g. "Vitamin C health" ->
+    "vitamin_c_health". Only when that could collide with another term's name (the
+    term contains "_" or other characters outside [A-Za-z0-9 .-], starts with
+    anything but a letter or digit, ends in a space or ".", is too long or is a
+    reserved name) are the unsafe characters collapsed to "_" and a short hash of
+    the term appended.
+    """
+    term = term.lower()
+    name = term.replace(' ', '_')
+    if (_PLAIN_TERM_RE.fullmatch(term) and not term.endswith((' ', '.'))
+            and len(name) <= _MAX_DIRNAME_LENGTH and name.split('.')[0].upper() not in _RESERVED_DIRNAMES):
+        return name
+    name = _UNSAFE_DIRNAME_RE.sub('_', term).strip('_.')[:_MAX_DIRNAME_LENGTH]
+    digest = hashlib.blake2s(term.encode('utf-8'), digest_size=4).hexdigest()
+    return f"{name}_{digest}" if name else digest
+
 
+def _load_index(index_path, k):
+    """
+    Read the per-term progress index written by a previous batch run.
+    
+    Returns:
+        Dictionary mapping finished terms to their file paths. Terms recorded with a
+        smaller k or with no files, or whose files have since been removed, are left out.
+    """
+    finished = {}
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Line torn by a crash mid-write
+                    continue
+                # A term that came back empty (its search or every PDF fetch failed)
+                # was never finished, so it runs again
+                files = record["files"]
+                if record.get("k", 0) >= k and files and all(os.path.exists(path) for path in files):
+                    finished[record["term"]] = files[:k]
+                else:
+                    finished.pop(record["term"], None)
+    except OSError:
+        pass
+    return finished
 
-def batch_download_papers(search_terms, k=20, base_download_dir="downloads", use_pubmed=True, headless=True):
+
+def batch_download_papers(search_terms, k=20, base_download_dir="downloads", use_pubmed=True, headless=True,
+                          max_workers=4, force_browser=False, use_cache=True, force=False,
+                          retry_count=1, retry_delay=1.0, api_key=None, email=None, tool=NCBI_TOOL,
+                          union_search=False):
     """
     Download top k papers for each search term.
     
@@ -21,81 +176,265 @@ def batch_download_papers(search_terms, k=20, base_download_dir="downloads", use
         use_pubmed: If True, use PubMed search (default: True).
                    If False, use direct PMC search.
         headless: Whether to run browser in headless mode (default: True).
-                 Set to False for debugging.
+                 Set to False for debugging. Only used with force_browser.
+        max_workers: Number of search terms processed concurrently (default: 4).
+                     Lower this to throttle.
+        force_browser: If True, use the standalone downloaders instead of the shared
+                       E-utilities pipeline; for PubMed that means driving Playwright
+                       (default: False).
+        use_cache: If True, reuse E-utilities lookups cached under
+                   base_download_dir/.cache (default: True).
+        force: If True, download again even when a term's directory already
+               holds its PDFs or the progress index marks it finished (default: False).
+        retry_count: How many times to retry a term after a transient failure
+                     such as a timeout or an NCBI 429/5xx response (default: 1).
+                     Each NCBI request is already retried up to 5 times with
+                     backoff, so this only re-runs a term whose requests ran out
+                     of retries; every extra term retry multiplies the attempts.
+        retry_delay: Base delay in seconds for exponential backoff between
+                     retries (default: 1.0).
+        api_key: Optional NCBI API key (default: the NCBI_API_KEY environment
+                 variable). Requests from all workers share one rate limit:
+                 3 req/s without a key, 10 req/s with one.
+        email: Contact email sent to NCBI (default: the NCBI_EMAIL environment variable)
+        tool: Tool name sent to NCBI (default: "medical_paper_downloader")
+        union_search: If True, combine all terms into one "(a) OR (b) OR ..." query
+                      and download its top k * len(search_terms) papers into a single
+                      directory, costing one search instead of one per term. The
+                      result is keyed by the combined query (default: False).
+    
+    Every term that downloads at least one PDF is appended to
+    base_download_dir/batch_index.jsonl, so an interrupted batch resumes with only
+    the unfinished terms; a term that came back empty is tried again. Without
+    force_browser, PDFs are kept once in base_download_dir/_by_pmcid and linked
+    into each term's directory, so articles shared by several terms download once.
     
     Returns:
         Dictionary mapping search terms to lists of downloaded file paths
     """
     results = {}
     
+    if union_search and len(search_terms) > 1:
+        # One search round trip for the union instead of one per term
+        k *= len(search_terms)
+        search_terms = [" OR ".join(f"({term})" for term in search_terms)]
+    
+    # Loop invariants, computed once and shared by every worker
+    term_count = len(search_terms)
+    rule = "=" * 60
+    dash_rule = "-" * 60
     method_name = "PubMed" if use_pubmed else "PMC"
-    print(f"Starting batch download for {len(search_terms)} search terms")
-    print(f"Method: {method_name}")
-    print(f"Will download top {k} papers for each term\n")
-    print("=" * 60)
+    method_name += " (browser)" if force_browser and use_pubmed else " (E-utilities)"
+    _setup_logging()
+    logger.info(
+        "Starting batch download for %d search terms\n"
+        "Method: %s\n"
+        "Will download top %d papers for each term\n\n"
+        "%s",
+        term_count, method_name, k, rule
+    )
     
-    for i, term in enumerate(search_terms, 1):
-        print(f"\n[{i}/{len(search_terms)}] Processing: {term}")
-        print("-" * 60)
+    results_lock = threading.Lock()
+    cache = JsonCache(os.path.join(base_download_dir, ".cache", "eutils.json")) if use_cache else None
+    
+    dirnames = {term: _term_dirname(term) for term in search_terms}
+    
+    def _run(term, browser):
+        # Create a subdirectory for each search term, once, before any PDF is written
+        download_dir = os.path.join(base_download_dir, dirnames[term])
+        os.makedirs(download_dir, exist_ok=True)
         
-        # Create a subdirectory for each search term
-        # Replace spaces and special characters with underscores
-        safe_term = term.replace(' ', '_').replace('/', '_')
-        download_dir = os.path.join(base_download_dir, safe_term)
+        # Terms finished on a previous run need no network round trips at all
+        if not force:
+            existing = sorted(
+                entry.path for entry in os.scandir(download_dir)
+                if entry.is_file() and entry.name.endswith('.pdf')
+            )
+            if len(existing) >= k:
+                return existing[:k]
         
-        try:
-            if use_pubmed:
-                downloaded_files = download_pubmed_free_fulltext_papers(
-                    search_term=term,
-                    k=k,
-                    download_dir=download_dir,
-                    headless=headless
-                )
-            else:
-                downloaded_files = download_pmc_papers(
-                    search_term=term,
-                    k=k,
-                    download_dir=download_dir,
-                    headless=headless
-                )
-            results[term] = downloaded_files
-            print(f"✓ Completed: {term} - {len(downloaded_files)} papers downloaded")
-        except Exception as e:
-            print(f"✗ Error processing {term}: {e}")
-            results[term] = []
-    
-    print("\n" + "=" * 60)
-    print("\nBatch download summary:")
-    print("-" * 60)
-    total_downloaded = 0
-    for term, files in results.items():
-        count = len(files)
-        total_downloaded += count
-        print(f"  {term}: {count} papers")
-    
-    print(f"\nTotal papers downloaded: {total_downloaded}")
-    print(f"Download location: {base_download_dir}/")
+        if not force_browser:
+            downloaded_files = download_pmc_papers_http(
+                search_term=term,
+                k=k,
+                download_dir=download_dir,
+                use_pubmed=use_pubmed,
+                api_key=api_key,
+                email=email,
+                tool=tool,
+                session=SESSION,
+                cache=cache,
+                skip_existing=not force,
+                store_dir=os.path.join(base_download_dir, "_by_pmcid")
+            )
+        elif use_pubmed:
+            downloaded_files = download_pubmed_free_fulltext_papers(
+                search_term=term,
+                k=k,
+                download_dir=download_dir,
+                headless=headless,
+                browser=browser
+            )
+        else:
+            downloaded_files = download_pmc_papers(
+                search_term=term,
+                k=k,
+                download_dir=download_dir,
+                headless=headless,
+                browser=browser
+            )
+        return downloaded_files or []
+    
+    def _run_with_retry(term, browser):
+        for attempt in range(retry_count + 1):
+            try:
+                return _run(term, browser)
+            except Exception as e:
+                if attempt == retry_count or not is_retriable_error(e):
+                    raise
+                # Exponential backoff with jitter so workers don't retry in lockstep
+                delay = retry_delay * 2 ** attempt + random.random()
+                logger.warning("  Transient error for %s (%s); retrying in %.1fs", term, e, delay)
+                time.sleep(delay)
+    
+    os.makedirs(base_download_dir, exist_ok=True)
+    index_path = os.path.join(base_download_dir, "batch_index.jsonl")
+    finished = {} if force else _load_index(index_path, k)
+    
+    term_queue = queue.Queue()
+    for i, term in enumerate(search_terms, 1):
+        if term in finished:
+            results[term] = finished[term]
+        else:
+            term_queue.put((i, term))
+    if finished:
+        logger.info("Resuming: %d term(s) already finished in %s", len(results), index_path)
+    
+    def _worker():
+        # Playwright's sync API is bound to the thread that started it, so each
+        # worker launches one browser and reuses it for every term it picks up.
+        # Only the PubMed downloader drives a browser.
+        with contextlib.ExitStack() as stack:
+            browser = None
+            if force_browser and use_pubmed:
+                try:
+                    playwright = stack.enter_context(sync_playwright())
+                    browser = launch_browser(playwright, headless)
+                    stack.callback(browser.close)
+                except Exception as e:
+                    logger.error("✗ Could not launch shared browser, falling back to one per term: %s", e)
+            
+            while True:
+                try:
+                    i, term = term_queue.get_nowait()
+                except queue.Empty:
+                    return
+                
+                logger.info("\n[%d/%d] Processing: %s\n%s", i, term_count, term, dash_rule)
+                
+                # Per-term failures are isolated so one term can't stop the worker
+                try:
+                    downloaded_files = _run_with_retry(term, browser)
+                    with results_lock:
+                        results[term] = downloaded_files
+                        # Downloaders swallow search and fetch errors and return [], so
+                        # only a term with files to show for it is recorded as finished
+                        if downloaded_files:
+                            index_file.write(json.dumps({
+                                "term": term, "k": k, "files": downloaded_files, "ts": time.time()
+                            }) + "\n")
+                            index_file.flush()
+                            os.fsync(index_file.fileno())
+                    logger.info("✓ Completed: %s - %d papers downloaded", term, len(downloaded_files))
+                except Exception as e:
+                    with results_lock:
+                        results[term] = []
+                    # The traceback is kept in the log file; the console gets one line
+                    logger.exception("✗ Error processing %s: %s", term, e)
+    
+    with open(index_path, "a", encoding="utf-8") as index_file, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        workers = [executor.submit(_worker) for _ in range(min(max_workers, term_queue.qsize()))]
+        for worker in workers:
+            worker.result()
+    
+    # Report in the caller's order rather than completion order
+    results = {term: results[term] for term in search_terms}
+    
+    # Emit the summary as one record so it can't interleave with other output
+    total_downloaded = sum(len(files) for files in results.values())
+    logger.info("\n".join([
+        "\n" + rule,
+        "\nBatch download summary:",
+        dash_rule,
+        *[f"  {term}: {len(files)} papers" for term, files in results.items()],
+        f"\nTotal papers downloaded: {total_downloaded}",
+        f"Download location: {base_download_dir}/",
+    ]))
     
     return results
 
 
-if __name__ == "__main__":
-    # Search terms to process
-    search_terms = [
-        'Probiotics health',
-        'Vitamin B health',
-        'Vitamin C health',
-        'Vitamin D health',
-        'Collagen health' ,
-        'Coenzyme Q10 health',
-        'Calcium health',
-        'Iron health',
-        'Magnesium health',
-        'Fish Oil health'
-    ]
-    
-    # Download top 20 papers for each term
-    results = batch_download_papers(search_terms, k=15, use_pubmed=True)
-    
-    print("\n✓ Batch download complete!")
+DEFAULT_SEARCH_TERMS = [
+    'Probiotics health',
+    'Vitamin B health',
+    'Vitamin C health',
+    'Vitamin D health',
+    'Collagen health',
+    'Coenzyme Q10 health',
+    'Calcium health',
+    'Iron health',
+    'Magnesium health',
+    'Fish Oil health'
+]
+
+
+def _read_terms_file(path):
+    """Read search terms from a text file: one per line, blank lines and '#' comments ignored."""
+    with open(path, encoding="utf-8") as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return [line for line in lines if line]
 
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Download papers for a batch of search terms.")
+    parser.add_argument("terms", nargs="*",
+                        help="search terms (default: the built-in supplement list)")
+    parser.add_argument("--terms-file",
+                        help="file with one search term per line; '#' starts a comment")
+    parser.add_argument("-k", type=int, default=15,
+                        help="number of papers to download per term (default: 15)")
+    parser.add_argument("--base-dir", default="downloads",
+                        help="base directory for downloads (default: downloads)")
+    parser.add_argument("--pmc", action="store_true",
+                        help="search PMC directly instead of PubMed")
+    parser.add_argument("--browser", action="store_true",
+                        help="drive Playwright instead of the E-utilities API")
+    parser.add_argument("--union", action="store_true",
+                        help="run one OR-combined search for all terms into a single directory")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of terms processed concurrently (default: 4)")
+    parser.add_argument("--force", action="store_true",
+                        help="download again even if a term's PDFs are already on disk")
+    args = parser.parse_args()
+    
+    search_terms = list(args.terms)
+    if args.terms_file:
+        search_terms += _read_terms_file(args.terms_file)
+    if not search_terms:
+        search_terms = DEFAULT_SEARCH_TERMS
+    
+    results = batch_download_papers(
+        search_terms,
+        k=args.k,
+        base_download_dir=args.base_dir,
+        use_pubmed=not args.pmc,
+        max_workers=args.workers,
+        force_browser=args.browser,
+        force=args.force,
+        union_search=args.union
+    )
+    
+    logger.info("\n✓ Batch download complete!")
@@ -0,0 +1,117 @@
+"""
+Batch Downloader Server
+
+Keeps one Python process, with its pooled NCBI session, warm between batch jobs, so
+repeated jobs skip interpreter start-up and connection set-up.
+
+POST a JSON object of batch_download_papers() keyword arguments to /batch, e.g.
+{"search_terms": ["vitamin c health"], "k": 15}; "terms" is accepted as a shorthand
+for "search_terms". The response is the results dictionary mapping each term to its
+downloaded file paths.
+"""
+
+import inspect
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from batch_downloader import batch_download_papers
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Jobs run one at a time so concurrent requests don't multiply browsers or NCBI traffic
+_BATCH_LOCK = threading.Lock()
+
+
+class BatchRequestHandler(BaseHTTPRequestHandler):
+    """Handle POST /batch by running batch_download_papers() in the warm process."""
+    
+    def do_POST(self):
+        if self.path.rstrip('/') != "/batch":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(job, dict):
+                raise ValueError("body must be a JSON object")
+            if "terms" in job:
+                job["search_terms"] = job.pop("terms")
+            terms = job.get("search_terms")
+            # A bare string is iterable too, and would run one search per character
+            if not isinstance(terms, list) or not terms or not all(isinstance(term, str) for term in terms):
+                raise ValueError("'search_terms' must be a non-empty list of strings")
+            # Reject unknown or missing arguments before any work starts
+            inspect.signature(batch_download_papers).bind(**job)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        
+        with _BATCH_LOCK:
+            try:
+                results = batch_download_papers(**job)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+        self._send_json(200, results)
+    
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """
+    Run the batch server until interrupted.
+    
+    Args:
+        host: Interface to bind (default: "127.0.0.1", local connections only)
+        port: Port to listen on (default: 8765)
+    """
+    server = ThreadingHTTPServer((host, port), BatchRequestHandler)
+    print(f"Batch downloader server listening on http://{host}:{port}/batch")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def submit_batch(search_terms, url: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}/batch", **kwargs):
+    """
+    Send a batch job to a running server and wait for its results.
+    
+    Args:
+        search_terms: List of search terms
+        url: Address of the server's /batch endpoint
+        **kwargs: Any other batch_download_papers() keyword arguments
+    
+    Returns:
+        Dictionary mapping search terms to lists of downloaded file paths
+    """
+    response = requests.post(url, json={"search_terms": list(search_terms), **kwargs})
+    response.raise_for_status()
+    return response.json()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Serve batch downloads from a warm process.")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help=f"interface to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on (default: {DEFAULT_PORT})")
+    args = parser.parse_args()
+    
+    serve(args.host, args.port)
@@ -2,746 +2,1421 @@
 PMC Paper Downloader
 
 This script searches PubMed Central (PMC) and downloads the top k papers in PDF format.
+
+Requests to the NCBI APIs identify the client with `tool` and `email` parameters and
+an optional API key, as NCBI asks. When not passed explicitly they default to the
+NCBI_API_KEY and NCBI_EMAIL environment variables. With an API key the shared rate
+limit rises from 3 to 10 requests per second.
 """
 
+import contextlib
+import functools
+import io
+import json
+import logging
 import os
+import random
 import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
 import urllib.parse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logging.handlers import MemoryHandler
 from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+IDCONV_MAX_IDS = 200
+OA_SERVICE_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi"
+PMC_BASE_URL = "https://pmc.ncbi.nlm.nih.gov"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PDF_WRITE_BUFFER_SIZE = 1024 * 1024
+NCBI_TOOL = "medical_paper_downloader"
+NCBI_RATE_LIMIT = 3
+NCBI_RATE_LIMIT_WITH_KEY = 10
+RETRIABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+SEARCH_CACHE_TTL = 24 * 60 * 60
+PMCID_CACHE_TTL = 7 * 24 * 60 * 60
+CONTEXT_RECYCLE_PAGES = 20
+# Set PAPER_DOWNLOADER_DEBUG to save a screenshot and the HTML of a search page that yields no results
+_DEBUG = bool(os.environ.get("PAPER_DOWNLOADER_DEBUG"))
+# Link extraction never needs images, the GPU or extensions, so Chromium skips them
+CHROMIUM_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-extensions",
+    "--disable-background-networking",
+]
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+LOG_BUFFER_CAPACITY = 1000
+
+# Progress lines go through logging. When neither this logger nor the root logger has
+# handlers (a plain script), a buffered stdout handler is attached on first use;
+# applications that configure logging themselves get the records the usual way.
+logger = logging.getLogger("paper_downloader")
+_log_setup_lock = threading.Lock()
+_default_log_handler = None
+
+
+def _setup_logging():
+    """
+    Send this module's log records to stdout through a MemoryHandler, message only,
+    unless the application has configured logging.
+    
+    Records are written in blocks, when the buffer fills, an error is logged or a
+    download function returns, instead of one write() per progress line. Nothing is
+    attached if this logger or the root logger already has handlers, and the default
+    handler is removed again once the application configures the root logger, so
+    records then propagate to the application's handlers instead.
+    """
+    global _default_log_handler
+    with _log_setup_lock:
+        if _default_log_handler is not None:
+            if _default_log_handler in logger.handlers and logging.getLogger().handlers:
+                logger.removeHandler(_default_log_handler)
+                _default_log_handler.close()
+                _default_log_handler = None
+                logger.setLevel(logging.NOTSET)
+            return
+        if logger.handlers or logging.getLogger().handlers:
+            return
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        _default_log_handler = MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=console_handler)
+        logger.addHandler(_default_log_handler)
+        logger.setLevel(logging.INFO)
+
+
+def _flushes_log(func):
+    """Set up logging before func runs and flush buffered records once it returns."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _setup_logging()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            for handler in logger.handlers:
+                handler.flush()
+    return wrapper
+
+
+def launch_browser(playwright, headless: bool = True):
+    """
+    Launch the Chromium instance used by the browser-based downloaders.
+    
+    Images are disabled and GPU, extension and background-network work is switched off
+    (see CHROMIUM_ARGS), since only the pages' links are read.
+    
+    Args:
+        playwright: A started Playwright instance (from sync_playwright())
+        headless: Whether to run browser in headless mode (default: True)
+    
+    Returns:
+        A Playwright Browser; the caller is responsible for closing it
+    """
+    return playwright.chromium.launch(headless=headless, args=CHROMIUM_ARGS)
+
+
+def _new_context(browser, storage_state=None):
+    """
+    Create a browser context that looks like a regular desktop Chrome session.
+    
+    storage_state may be a dict or the path of a file written by context.storage_state().
+    """
+    return browser.new_context(
+        storage_state=storage_state,
+        accept_downloads=True,
+        viewport={"width": 1920, "height": 1080},
+        user_agent=USER_AGENT,
+        extra_http_headers={
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Accept-Encoding": "gzip, deflate, br",
+            "Connection": "keep-alive",
+            "Upgrade-Insecure-Requests": "1",
+            "Sec-Fetch-Dest": "document",
+            "Sec-Fetch-Mode": "navigate",
+            "Sec-Fetch-Site": "none",
+            "Sec-Fetch-User": "?1",
+        }
+    )
+
+
+class ContextPool:
+    """
+    Hand out pages from one browser context, recycling the context every `max_pages` pages.
+    
+    Playwright only frees a context's DOM and JS heap when the context closes, so a
+    context kept open across many navigations grows without bound. Cookies and local
+    storage are carried into each new context with storage_state.
+    
+    Use as a context manager; when no browser is passed, a private one is launched
+    on the first call to page() and closed on exit. With storage_state_path, the first
+    context is seeded from that file (if it exists) and the final cookies are saved back
+    to it on exit, so NCBI session cookies survive between runs.
+    """
+    
+    def __init__(self, browser=None, headless: bool = True, max_pages: int = CONTEXT_RECYCLE_PAGES,
+                 storage_state_path: str = None):
+        self.max_pages = max_pages
+        self.storage_state_path = storage_state_path
+        self._browser = browser
+        self._headless = headless
+        self._stack = None
+        self._context = None
+        self._page = None
+        self._pages_served = 0
+    
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        return self
+    
+    def __exit__(self, *exc_info):
+        try:
+            self._close_context()
+        finally:
+            self._stack.close()
+    
+    def page(self):
+        """Close the previously handed-out page and return a fresh one."""
+        if self._browser is None:
+            # Launched on first use, so runs that never need a page never start Chromium
+            playwright = self._stack.enter_context(sync_playwright())
+            self._browser = launch_browser(playwright, self._headless)
+            self._stack.callback(self._browser.close)
+        if self._page is not None:
+            self._page.close()
+            self._page = None
+        if self._context is not None and self._pages_served >= self.max_pages:
+            storage_state = self._context.storage_state()
+            self._context.close()
+            self._context = _new_context(self._browser, storage_state)
+            self._pages_served = 0
+        if self._context is None:
+            saved_state = self.storage_state_path
+            if saved_state is not None and not os.path.exists(saved_state):
+                saved_state = None
+            self._context = _new_context(self._browser, saved_state)
+        self._pages_served += 1
+        self._page = self._context.new_page()
+        return self._page
+    
+    def _close_context(self):
+        if self._context is not None:
+            if self.storage_state_path is not None:
+                try:
+                    self._context.storage_state(path=self.storage_state_path)
+                except Exception as e:
+                    logger.warning("Warning: could not save browser state to %s: %s", self.storage_state_path, e)
+            self._context.close()
+        self._context = self._page = None
+
+
+# PMIDs in result hrefs: /28390121/, /pubmed/28390121/, https://pubmed.ncbi.nlm.nih.gov/28390121/
+_PMID_TAIL_RE = re.compile(r'/(\d{6,})/?$')
+_PMID_EMBED_RE = re.compile(r'pubmed[^/]*/(\d{6,})')
+_PMC_HREF_RE = re.compile(r'PMC(\d+)', re.IGNORECASE)
+# Stricter form for free text, where short "PMC" matches are likely noise
+_PMC_TEXT_RE = re.compile(r'PMC(\d{6,})', re.IGNORECASE)
+_BASE_PMC = PMC_BASE_URL + "/"
+
+
+def _pmc_url(href: str) -> str:
+    """Resolve an href (absolute, root-relative, scheme-relative or relative) against PMC."""
+    return urllib.parse.urljoin(_BASE_PMC, href)
+
+
+# Browser round trips dominate link extraction, so each page's links are read with a
+# single evaluate() call and filtered in Python.
+# Hrefs matched by each selector in a list, in order (an invalid selector yields none)
+_HREFS_BY_SELECTOR_JS = """(selectors) => selectors.map(selector => {
+    try {
+        return Array.from(document.querySelectorAll(selector), a => a.getAttribute('href'));
+    } catch (e) {
+        return [];
+    }
+})"""
+# Hrefs on a PubMed article page that may lead to PMC, most reliable first
+_PMC_LINK_CANDIDATES_JS = """() => {
+    const hrefs = els => Array.from(els, a => a.getAttribute('href')).filter(Boolean);
+    const section = document.querySelector('#full-view-heading, .full-text-links, [id*="full"], [class*="full-text"]');
+    const anchors = Array.from(document.querySelectorAll('a[href]'));
+    const withText = text => anchors.filter(a => a.textContent.toUpperCase().includes(text));
+    return [
+        ...(section ? hrefs(section.querySelectorAll('a[href*="PMC"], a[href*="pmc"]')) : []),
+        ...hrefs(document.querySelectorAll('a[href*="/articles/PMC"]')),
+        ...hrefs(document.querySelectorAll('a[href*="pmc.ncbi.nlm.nih.gov"]')),
+        ...hrefs(document.querySelectorAll('a[href*="PMC"]')),
+        ...hrefs(withText('PMC')),
+        ...hrefs(withText('PUBMED CENTRAL')),
+    ];
+}"""
+# The PMCID meta tag when the page has one, else the visible text, never the full
+# serialized HTML with its scripts and navigation markup
+_PMCID_TEXT_JS = """() => {
+    const meta = document.querySelector('meta[name="ncbi_pmcid"], meta[name="citation_pmcid"]');
+    return (meta && meta.content) || (document.body ? document.body.innerText : '');
+}"""
+
+
+def _preallocate(file, content_length):
+    """Reserve content_length bytes for file up front where the OS supports it, so the PDF lands in one extent."""
+    if not content_length or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(file.fileno(), 0, int(content_length))
+    except (OSError, ValueError):
+        # Unsupported filesystem or a malformed header; the file just grows as it's written
+        pass
+
+
+def _stream_pdf(session, url: str, download_path: Path, default_filename: str, limiter=None,
+                cookies: dict = None):
+    """
+    Stream a PDF from url into download_path.
+    
+    The body is written through a large buffer rather than held in memory: peak memory
+    per download is one chunk plus the buffer (~1.1 MB) whatever the PDF size, so
+    response.content must never be read here. The %PDF check runs on the first chunk,
+    before any file exists, and the file only appears under its final name once complete.
+    
+    Args:
+        session: requests.Session to download with
+        url: PDF URL
+        download_path: Directory to save the PDF in
+        default_filename: Name to use when the final URL doesn't end in .pdf
+        limiter: Optional RateLimiter to acquire before each request
+        cookies: Optional cookies to send, e.g. taken from a browser context
+    
+    Returns:
+        The saved file path, or None if the server did not return a PDF
+    """
+    with _request_with_backoff(
+        session, "GET", url,
+        limiter=limiter,
+        cookies=cookies,
+        # PDFs are already compressed internally; gzipping them again only costs CPU
+        headers={'Accept': 'application/pdf,application/octet-stream,*/*', 'Accept-Encoding': 'identity'},
+        timeout=30,
+        stream=True
+    ) as response:
+        # Headers arrive before the body, so an HTML error or embargo page is turned away unread
+        if not response.ok or response.headers.get('Content-Type', '').startswith('text/html'):
+            return None
+        
+        chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        first_chunk = next(chunks, b'')
+        if not first_chunk.startswith(b'%PDF'):
+            return None
+        
+        filename = response.url.rstrip('/').split('/')[-1]
+        if not filename.endswith('.pdf'):
+            filename = default_filename
+        
+        file_path = download_path / filename
+        # Written under a unique .part name and renamed once complete, so an interrupted
+        # download never leaves a truncated PDF where a finished one is expected, and two
+        # downloads of the same PDF into one directory never share a .part file
+        part_path = download_path / f"{filename}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            # Coalesce the 64 KB network chunks into few large write syscalls
+            with open(part_path, 'xb', buffering=0) as raw, io.BufferedWriter(raw, buffer_size=PDF_WRITE_BUFFER_SIZE) as f:
+                _preallocate(raw, response.headers.get('Content-Length'))
+                f.write(first_chunk)
+                for chunk in chunks:
+                    f.write(chunk)
+                # Drop any preallocated tail if the body came up short of Content-Length
+                f.truncate()
+                f.flush()
+            os.replace(part_path, file_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                part_path.unlink()
+            raise
+    return str(file_path)
+
 
-def download_pmc_papers(search_term: str, k: int = 5, download_dir: str = "downloads", headless: bool = True):
+@_flushes_log
+def download_pmc_papers(search_term: str, k: int = 5, download_dir: str = "downloads", headless: bool = True,
+                        browser=None, max_workers: int = 4):
     """
     Search PMC and download the top k papers in PDF format.
     
+    The search runs through the E-utilities esearch API and each PDF URL comes from the
+    PMC Open Access service (or, for articles outside the OA subset, PMC's
+    /articles/{PMC_ID}/pdf/ redirect), so no browser or article page is needed. The
+    resolved PDF links are cached for a day in download_dir/.cache, so repeating a
+    search skips straight to the downloads.
+    
     Args:
         search_term: The search term (e.g., "vitamin c")
         k: Number of top papers to download (default: 5)
         download_dir: Directory to save downloaded PDFs (default: "downloads")
-        headless: Whether to run browser in headless mode (default: True)
+        headless: Unused; kept so existing callers keep working
+        browser: Unused; kept so existing callers keep working
+        max_workers: Number of PDFs fetched concurrently (default: 4)
     
     Returns:
         List of downloaded file paths
     """
-    # Create download directory if it doesn't exist
+    # Create download directory (and any missing parents) once up front
     download_path = Path(download_dir)
-    download_path.mkdir(exist_ok=True)
-    
-    # Construct search URL
-    encoded_term = urllib.parse.quote(search_term)
-    search_url = f"https://pmc.ncbi.nlm.nih.gov/search/?term={encoded_term}"
+    download_path.mkdir(parents=True, exist_ok=True)
     
     downloaded_files = []
+    identity = ncbi_identity()
     
-    with sync_playwright() as p:
-        # Launch browser
-        browser = p.chromium.launch(headless=headless)
-        context = browser.new_context(
-            accept_downloads=True,
-            viewport={"width": 1920, "height": 1080},
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            extra_http_headers={
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "none",
-                "Sec-Fetch-User": "?1",
-            }
-        )
-        page = context.new_page()
-        
+    # Warm runs reuse the resolved (PMCID, PDF link) pairs and skip straight to downloading
+    cache = JsonCache(download_path / ".cache" / "resolved.json")
+    cache_key = f"pmc|{search_term}|{k}"
+    articles = cache.get(cache_key)
+    if articles is not None:
+        logger.info("Using cached PMC results for: %s", search_term)
+    else:
         try:
-            print(f"Searching PMC for: {search_term}")
-            print(f"Search URL: {search_url}")
-            
-            # Navigate to search results
-            page.goto(search_url, wait_until="networkidle", timeout=5000)
-            time.sleep(1)  # Wait for page to fully load
-            
-            # Find all result links
-            # PMC search results typically have links with class or data attributes
-            # We'll look for links that contain PMC IDs
-            result_links = []
-            
-            # Try multiple selectors to find result links
-            selectors = [
-                'a[href*="/articles/PMC"]',
-                'a[href*="pmc/articles"]',
-                '.result-item a',
-                '.rprt a',
-                'a[data-article-id]'
-            ]
-            
-            for selector in selectors:
-                links = page.query_selector_all(selector)
-                if links:
-                    for link in links:
-                        href = link.get_attribute('href')
-                        if href and ('PMC' in href or '/articles/' in href):
-                            # Make absolute URL if needed
-                            if href.startswith('/'):
-                                href = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                            elif not href.startswith('http'):
-                                href = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                            
-                            if href not in result_links:
-                                result_links.append(href)
-                    if result_links:
-                        break
-            
-            # If no links found with selectors, try to find by text pattern
-            if not result_links:
-                print("Trying alternative method to find results...")
-                # Look for any links that might be article links
-                all_links = page.query_selector_all('a')
-                for link in all_links:
-                    href = link.get_attribute('href')
-                    if href and ('/articles/PMC' in href or 'pmc/articles' in href):
-                        if href.startswith('/'):
-                            href = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                        elif not href.startswith('http'):
-                            href = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                        if href not in result_links:
-                            result_links.append(href)
-            
-            if not result_links:
-                print("No results found. The page structure might have changed.")
-                print("Page title:", page.title())
-                # Save page for debugging
-                page.screenshot(path="debug_search_page.png")
-                return downloaded_files
-            
-            # Limit to top k results
-            result_links = result_links[:k]
-            print(f"Found {len(result_links)} result(s) to process")
-            
-            # Process each result
-            for i, article_url in enumerate(result_links, 1):
-                try:
-                    print(f"\n[{i}/{len(result_links)}] Processing: {article_url}")
-                    
-                    # Extract PMC ID from article URL
-                    # URL format: https://pmc.ncbi.nlm.nih.gov/articles/PMC7681026
-                    pmc_id = article_url.split('/')[-1] if '/' in article_url else None
-                    
-                    # Navigate to article page
-                    page.goto(article_url, wait_until="networkidle", timeout=5000)
-                    time.sleep(1)
-                    
-                    # Look for PDF link that follows the pattern: /articles/{PMC_ID}/pdf/{filename}.pdf
-                    # Example: https://pmc.ncbi.nlm.nih.gov/articles/PMC7681026/pdf/zbc15870.pdf
-                    pdf_link = None
-                    
-                    # Priority 1: Look for PDF link with the exact pattern /articles/{PMC_ID}/pdf/{filename}.pdf
-                    if pmc_id:
-                        # Try exact pattern first: /articles/PMC7681026/pdf/
-                        pdf_links = page.query_selector_all(f'a[href*="/articles/{pmc_id}/pdf/"]')
-                        if not pdf_links:
-                            # Also try without "PMC" prefix in case URL format differs
-                            pmc_num = pmc_id.replace('PMC', '') if pmc_id.startswith('PMC') else pmc_id
-                            pdf_links = page.query_selector_all(f'a[href*="/articles/{pmc_num}/pdf/"]')
-                        
-                        if pdf_links:
-                            for link in pdf_links:
-                                href = link.get_attribute('href')
-                                if href:
-                                    # Normalize the href to full URL
-                                    if href.startswith('/'):
-                                        full_href = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                    elif not href.startswith('http'):
-                                        full_href = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                    else:
-                                        full_href = href
-                                    
-                                    # Check if it matches the pattern /articles/{PMC_ID}/pdf/{filename}.pdf
-                                    if f'/articles/{pmc_id}/pdf/' in full_href and full_href.endswith('.pdf'):
-                                        pdf_link = full_href
-                                        break
-                                    # Also check pattern with just the number
-                                    elif pmc_id.startswith('PMC'):
-                                        pmc_num = pmc_id.replace('PMC', '')
-                                        if f'/articles/{pmc_num}/pdf/' in full_href and full_href.endswith('.pdf'):
-                                            pdf_link = full_href
-                                            break
-                                    # If it contains the pattern but might be missing .pdf extension
-                                    elif f'/articles/{pmc_id}/pdf/' in full_href:
-                                        pdf_link = full_href
-                                        break
-                        
-                        # Also look for links with text "PDF" that might have the pattern
-                        if not pdf_link:
-                            pdf_text_links = page.query_selector_all('a:has-text("PDF"), a:has-text("pdf")')
-                            for link in pdf_text_links:
-                                href = link.get_attribute('href')
-                                if href and f'/articles/{pmc_id}/pdf/' in href:
-                                    if href.startswith('/'):
-                                        pdf_link = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                    elif not href.startswith('http'):
-                                        pdf_link = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                    else:
-                                        pdf_link = href
-                                    break
-                    
-                    # Priority 2: If we found a PDF link but it's not in the full pattern, try to construct it
-                    # Some pages use links like /pdf/filename.pdf or https://pmc.ncbi.nlm.nih.gov/pdf/filename.pdf
-                    # We want to use the pattern: /articles/{PMC_ID}/pdf/{filename}.pdf
-                    if not pdf_link and pmc_id:
-                        # Look for any PDF link and try to construct the full path
-                        all_pdf_links = page.query_selector_all('a[href*=".pdf"], a[href*="/pdf/"]')
-                        for link in all_pdf_links:
-                            href = link.get_attribute('href')
-                            if href and href.endswith('.pdf'):
-                                # Extract filename from any format
-                                filename = href.split('/')[-1]
-                                
-                                # If the link doesn't already follow the /articles/{PMC_ID}/pdf/ pattern,
-                                # construct it using the full pattern
-                                if f'/articles/{pmc_id}/pdf/' not in href:
-                                    # Construct the full pattern: /articles/{PMC_ID}/pdf/{filename}
-                                    constructed_url = f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/pdf/{filename}"
-                                    pdf_link = constructed_url
-                                    break
-                                # If it already contains the PMC ID in the correct pattern, use it
-                                elif f'/articles/{pmc_id}/pdf/' in href:
-                                    if href.startswith('/'):
-                                        pdf_link = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                    elif not href.startswith('http'):
-                                        pdf_link = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                    else:
-                                        pdf_link = href
-                                    break
-                    
-                    # Priority 3: Fallback - look for any PDF link on the page and construct full path if needed
-                    if not pdf_link and pmc_id:
-                        pdf_button_selectors = [
-                            'a[href*="/pdf/"]',
-                            'a[href$=".pdf"]',
-                            'a[href*=".pdf"]',
-                            'a:has-text("PDF")',
-                            'a[title*="PDF"]',
-                            'a[title*="pdf"]'
-                        ]
-                        
-                        for selector in pdf_button_selectors:
-                            try:
-                                element = page.query_selector(selector)
-                                if element:
-                                    href = element.get_attribute('href')
-                                    if href and href.endswith('.pdf'):
-                                        # Extract filename
-                                        filename = href.split('/')[-1]
-                                        # Always construct using the full pattern: /articles/{PMC_ID}/pdf/{filename}
-                                        pdf_link = f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/pdf/{filename}"
-                                        break
-                            except:
-                                continue
-                    
-                    # Download the PDF
-                    if pdf_link:
-                        try:
-                            print(f"  Found PDF link: {pdf_link}")
-                            
-                            # Extract filename from URL
-                            filename = pdf_link.split('/')[-1]
-                            if not filename.endswith('.pdf'):
-                                filename = f"{pmc_id or f'paper_{i}'}.pdf"
-                            
-                            # PMC PDFs require clicking the link to trigger download
-                            # Try multiple methods to download the PDF
-                            pdf_downloaded = False
-                            
-                            # Method 1: Try to find and click the PDF link on the article page
-                            pdf_link_selectors = [
-                                f'a[href*="/articles/{pmc_id}/pdf/"]',
-                                f'a[href*="/pdf/"]',
-                                'a:has-text("PDF")',
-                                'a[href$=".pdf"]'
-                            ]
-                            
-                            for selector in pdf_link_selectors:
-                                try:
-                                    pdf_element = page.query_selector(selector)
-                                    if pdf_element:
-                                        # Scroll element into view
-                                        pdf_element.scroll_into_view_if_needed()
-                                        time.sleep(0.3)
-                                        # Click the link and wait for download
-                                        with page.expect_download(timeout=5000) as download_info:
-                                            pdf_element.click()
-                                        download = download_info.value
-                                        
-                                        # Get suggested filename or use extracted one
-                                        suggested_filename = download.suggested_filename
-                                        if suggested_filename and suggested_filename.endswith('.pdf'):
-                                            filename = suggested_filename
-                                        
-                                        file_path = download_path / filename
-                                        download.save_as(file_path)
-                                        downloaded_files.append(str(file_path))
-                                        print(f"  ✓ Downloaded: {file_path}")
-                                        pdf_downloaded = True
-                                        break
-                                except (PlaywrightTimeoutError, Exception):
-                                    continue
-                            
-                            # Method 2: Use request API with proper headers to follow redirects
-                            if not pdf_downloaded:
-                                try:
-                                    # Set headers to mimic a browser request
-                                    response = context.request.get(
-                                        pdf_link,
-                                        headers={
-                                            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-                                            'Accept': 'application/pdf,application/octet-stream,*/*'
-                                        },
-                                        timeout=5000
-                                    )
-                                    
-                                    if response.ok:
-                                        body = response.body()
-                                        # Check if it's actually a PDF
-                                        if body.startswith(b'%PDF'):
-                                            file_path = download_path / filename
-                                            with open(file_path, 'wb') as f:
-                                                f.write(body)
-                                            downloaded_files.append(str(file_path))
-                                            print(f"  ✓ Downloaded: {file_path}")
-                                            pdf_downloaded = True
-                                except Exception as req_error:
-                                    pass
-                            
-                            # Method 3: Try direct navigation with download event
-                            if not pdf_downloaded:
-                                try:
-                                    with page.expect_download(timeout=5000) as download_info:
-                                        page.goto(pdf_link, wait_until="networkidle", timeout=5000)
-                                    download = download_info.value
-                                    file_path = download_path / filename
-                                    download.save_as(file_path)
-                                    downloaded_files.append(str(file_path))
-                                    print(f"  ✓ Downloaded: {file_path}")
-                                    pdf_downloaded = True
-                                except (PlaywrightTimeoutError, Exception):
-                                    pass
-                            
-                            if not pdf_downloaded:
-                                raise Exception("All download methods failed")
-                                    
-                        except Exception as e:
-                            print(f"  ✗ Error downloading PDF: {e}")
-                    else:
-                        print(f"  ✗ Could not find PDF link for article {i}")
-                    
-                    # Small delay between downloads
-                    time.sleep(0.5)
-                    
-                except Exception as e:
-                    print(f"  ✗ Error processing article {i}: {e}")
-                    continue
+            logger.info("Searching PMC for: %s", search_term)
+            # Repeated UIDs would have two workers writing the same PDF
+            uids = dict.fromkeys(_esearch(_SESSION, "pmc", search_term, k, identity))
+            articles = [[f"PMC{uid}", None] for uid in uids]
+        except (requests.RequestException, KeyError, ValueError) as e:
+            logger.warning("Error during search: %s", e)
+            return downloaded_files
+    
+    if not articles:
+        logger.warning("No results found.")
+        return downloaded_files
+    
+    logger.info("Found %d result(s) to process", len(articles))
+    # Every PMC request shares the NCBI rate limit, however many run in parallel
+    limiter = _ncbi_limiter(identity.get("api_key"))
+    
+    def _process(item):
+        i, (pmc_id, pdf_link) = item
+        try:
+            if pdf_link is None:
+                # Outside the OA subset, PMC redirects /articles/{PMC_ID}/pdf/ to the PDF itself
+                pdf_link = _oa_pdf_url(_SESSION, pmc_id, identity) or f"{PMC_BASE_URL}/articles/{pmc_id}/pdf/"
+            file_path = _stream_pdf(_SESSION, pdf_link, download_path, f"{pmc_id}.pdf", limiter=limiter)
+            if file_path is None:
+                logger.warning("  ✗ Error downloading PDF: %s did not return a PDF", pdf_link)
+            else:
+                logger.info("  ✓ Downloaded: %s", file_path)
+            return pdf_link, file_path
+        except (requests.RequestException, OSError) as e:
+            # Caught per article (OSError: e.g. a full disk) so one failure can't
+            # discard the PDFs the other workers already saved
+            logger.warning("  ✗ Error processing article %d (%s): %s", i, pmc_id, e)
+            return pdf_link, None
+    
+    # Independent HTTPS fetches overlap on a small pool
+    with ThreadPoolExecutor(max_workers=min(len(articles), max_workers)) as executor:
+        outcomes = list(executor.map(_process, enumerate(articles, 1)))
+    downloaded_files = [file_path for _, file_path in outcomes if file_path]
+    
+    resolved = [[pmc_id, pdf_link] for (pmc_id, _), (pdf_link, _) in zip(articles, outcomes) if pdf_link]
+    if resolved:
+        cache.set(cache_key, resolved, expire=SEARCH_CACHE_TTL)
+    
+    logger.info("\n✓ Download complete! %d file(s) downloaded to %s/", len(downloaded_files), download_dir)
+    return downloaded_files
+
+
+# Elements whose presence in the DOM means a page has loaded enough to extract links
+# from; links are read from the DOM, so they need not be visible or laid out yet
+_PUBMED_ARTICLE_READY_SELECTOR = '#full-view-identifiers, a[href*="/articles/PMC"]'
+_PMC_ARTICLE_READY_SELECTOR = 'a[href*="/articles/PMC"], a[href*="/pdf/"]'
+# PDF links on a PMC article page that don't depend on the PMCID, and how to rank them
+# (most specific first) once their (href, title) pairs are read
+_STATIC_PDF_SELECTORS = 'a[href*="/pdf/"], a[href$=".pdf"], a[title*="PDF"]'
+_STATIC_PDF_LINK_RANKS = (
+    lambda href, title: "/pdf/" in href,
+    lambda href, title: href.endswith(".pdf"),
+    lambda href, title: "PDF" in title,
+)
+_HREF_AND_TITLE_JS = "els => els.map(a => [a.getAttribute('href') || '', a.getAttribute('title') || ''])"
+
+
+def _goto(page, url: str, timeout: int = 10000):
+    """Navigate to an NCBI page once the shared rate limiter allows it, waiting only for the DOM."""
+    # The same bucket the E-utilities calls draw from, so page loads count against one limit
+    _ncbi_limiter(ncbi_identity().get("api_key")).acquire()
+    return page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+
+
+def _goto_pmc_article(page, pmc_link: str):
+    """Open a PMC article page and wait only until its links are in the DOM."""
+    _goto(page, pmc_link)
+    try:
+        page.wait_for_selector(_PMC_ARTICLE_READY_SELECTOR, state="attached", timeout=3000)
+    except PlaywrightTimeoutError:
+        pass
+
+
+def _download_in_browser(page, pmc_id: str, pmc_link: str, pdf_link: str, download_path: Path,
+                         click: bool = False):
+    """
+    Download a PDF through the browser, for when a plain HTTPS GET is refused.
+    
+    Tries, cheapest first: a streamed HTTPS GET carrying the browser's cookies (when
+    it has any for PMC), then navigating straight to the PDF. With click=True it
+    finally opens the article page and clicks its PDF link, which costs a full page
+    load and is rarely needed.
+    
+    Returns:
+        The saved file path, or None if every method failed
+    """
+    filename = pdf_link.split('/')[-1]
+    if not filename.endswith('.pdf'):
+        filename = f"{pmc_id}.pdf"
+    file_path = download_path / filename
+    
+    # Method 1: Stream over HTTPS with the browser's cookies. Playwright's request
+    # API would buffer the whole PDF in memory before it could be written out.
+    # Without cookies this is the plain GET that already failed, so it's skipped.
+    try:
+        cookies = {cookie["name"]: cookie["value"] for cookie in page.context.cookies(pdf_link)}
+        if cookies:
+            limiter = _ncbi_limiter(ncbi_identity().get("api_key"))
+            saved_path = _stream_pdf(_SESSION, pdf_link, download_path, filename, limiter=limiter, cookies=cookies)
+            if saved_path:
+                return saved_path
+    except (requests.RequestException, OSError):
+        pass
+    
+    # Method 2: Direct navigation
+    try:
+        with page.expect_download(timeout=10000) as download_info:
+            _goto(page, pdf_link)
+        download = download_info.value
+        download.save_as(file_path)
+        return str(file_path)
+    except (PlaywrightTimeoutError, Exception):
+        pass
+    
+    if not click:
+        return None
+    
+    # Method 3: Click the PDF link on the article page
+    try:
+        _goto_pmc_article(page, pmc_link)
+    except Exception:
+        pass
+    
+    # One DOM query covers every kind of PDF link; they are ranked in Python,
+    # most specific first, taking the first link of each kind
+    article_pdf_path = f"/articles/{pmc_id}/pdf/"
+    pdf_links_selector = f'a[href*="{article_pdf_path}"], {_STATIC_PDF_SELECTORS}'
+    try:
+        links = page.eval_on_selector_all(pdf_links_selector, _HREF_AND_TITLE_JS)
+    except Exception:
+        links = []
+    ranks = (lambda href, title: article_pdf_path in href, *_STATIC_PDF_LINK_RANKS)
+    indexes = []
+    for rank in ranks:
+        index = next((i for i, (href, title) in enumerate(links) if rank(href, title)), None)
+        if index is not None and index not in indexes:
+            indexes.append(index)
+    candidates = [page.locator(pdf_links_selector).nth(i) for i in indexes]
+    if not candidates:
+        # Text matching is slower, so it's only tried when no href or title matched
+        candidates = [page.locator('a:has-text("PDF")').first]
+    
+    for pdf_element in candidates:
+        try:
+            # click() already waits for the element to be visible, stable and enabled
+            with page.expect_download(timeout=10000) as download_info:
+                pdf_element.click(timeout=5000)
+            download = download_info.value
             
+            suggested_filename = download.suggested_filename
+            if suggested_filename and suggested_filename.endswith('.pdf'):
+                file_path = download_path / suggested_filename
+            download.save_as(file_path)
+            return str(file_path)
+        except (PlaywrightTimeoutError, Exception):
+            continue
+    return None
+
+
+def _search_pubmed_pmids(page, search_term: str, k: int):
+    """
+    Search PubMed in the browser and read the top k PMIDs off the results page.
+    
+    Args:
+        page: Browser page to run the search in
+        search_term: The search term
+        k: Number of PubMed results to return
+    
+    Returns:
+        List of PMIDs in result order (empty if none were found)
+    """
+    # Construct PubMed search URL
+    encoded_term = urllib.parse.quote(search_term)
+    search_url = f"https://pubmed.ncbi.nlm.nih.gov/?term={encoded_term}"
+    
+    logger.info("Searching PubMed for: %s", search_term)
+    logger.info("Search URL: %s", search_url)
+    logger.info("Navigating to PubMed...")
+    
+    # Navigate to PubMed search results; only the DOM is needed, not trailing
+    # analytics requests, and the results are awaited explicitly below
+    _goto(page, search_url, timeout=15000)
+    logger.info("Page loaded. Title: %s", page.title())
+    logger.info("Current URL: %s", page.url)
+    
+    # Wait for results to load - look for result items
+    try:
+        page.wait_for_selector('.docsum-content, .rprt, article, [class*="result"]', state="attached", timeout=10000)
+    except:
+        logger.warning("Warning: Results may not have loaded completely")
+    
+    # Find all PubMed result links (PMID links)
+    # PubMed result links typically look like: /28390121/ or https://pubmed.ncbi.nlm.nih.gov/28390121/
+    pubmed_links = []
+    # Set alongside the list for O(1) duplicate checks; the list keeps result order
+    seen_links = set()
+    
+    # Try multiple selectors to find result links - updated for current PubMed structure
+    selectors = [
+        '.docsum-title a',  # Most common selector for PubMed results
+        'a.docsum-title',   # Alternative class format
+        '.rprt a',          # Alternative result format
+        'article a',        # Article tag links
+        'a[href*="/pubmed/"]',  # Links containing /pubmed/
+    ]
+    # A catch-all like 'a[href^="/"]' would match every navigation link; pages where
+    # none of these match fall through to the filtered all-links pass below
+    
+    # Read every selector's hrefs, plus all links for that pass, in one round trip
+    hrefs_by_selector = page.evaluate(_HREFS_BY_SELECTOR_JS, selectors + ['a[href]'])
+    all_hrefs = hrefs_by_selector.pop()
+    
+    for selector, hrefs in zip(selectors, hrefs_by_selector):
+        if hrefs:
+            logger.info("Found %d links with selector: %s", len(hrefs), selector)
+            for href in hrefs:
+                if href:
+                    # Extract PMID from various URL patterns
+                    # Patterns: /28390121/, /pubmed/28390121/, https://pubmed.ncbi.nlm.nih.gov/28390121/
+                    pmid_match = _PMID_TAIL_RE.search(href) or _PMID_EMBED_RE.search(href)
+                    if pmid_match:
+                        pmid = pmid_match.group(1)
+                        pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+                        if pubmed_url not in seen_links:
+                            seen_links.add(pubmed_url)
+                            pubmed_links.append(pubmed_url)
+                            # Only the top k are used, so stop scanning once we have them
+                            if len(pubmed_links) >= k:
+                                break
+            if pubmed_links:
+                logger.info("Successfully extracted %d PubMed links", len(pubmed_links))
+                break
+    
+    # Alternative method: look for any links with numeric IDs that match PMID pattern
+    if not pubmed_links:
+        logger.info("Trying alternative method to find PubMed links...")
+        logger.info("Found %d total links on page", len(all_hrefs))
+        for href in all_hrefs:
+            if href:
+                # Look for patterns like /12345678/ or /pubmed/12345678/ or pubmed.ncbi.nlm.nih.gov/12345678/
+                # PMIDs are typically 6-8 digits
+                pmid_match = _PMID_TAIL_RE.search(href) or _PMID_EMBED_RE.search(href)
+                if pmid_match:
+                    pmid = pmid_match.group(1)
+                    # Validate it's a reasonable PMID (not a year or other number)
+                    if len(pmid) >= 6 and len(pmid) <= 8:
+                        pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+                        if pubmed_url not in seen_links:
+                            seen_links.add(pubmed_url)
+                            pubmed_links.append(pubmed_url)
+                            if len(pubmed_links) >= k * 2:  # Get extra to filter
+                                break
+    
+    if not pubmed_links:
+        logger.warning("No PubMed results found. The page structure might have changed.")
+        logger.info("Page title: %s", page.title())
+        logger.info("Page URL: %s", page.url)
+        if _DEBUG:
+            # Save page for debugging
+            page.screenshot(path="debug_pubmed_search_page.png")
+            # Also save HTML for inspection
+            with open("debug_pubmed_search_page.html", "w", encoding="utf-8") as f:
+                f.write(page.content())
+            logger.info("Debug files saved: debug_pubmed_search_page.png and debug_pubmed_search_page.html")
+        return []
+    
+    # Limit to top k results
+    return [_PMID_TAIL_RE.search(pubmed_url).group(1) for pubmed_url in pubmed_links[:k]]
+
+
+def _scrape_pmcid(page, pubmed_url: str):
+    """
+    Read the PMCID off a PubMed article page, for PMIDs the ID converter can't map.
+    
+    Returns:
+        (pmc_id, pmc_link), or (None, None) if the page shows no PMC copy
+    """
+    _goto(page, pubmed_url)
+    try:
+        page.wait_for_selector(_PUBMED_ARTICLE_READY_SELECTOR, state="attached", timeout=3000)
+    except PlaywrightTimeoutError:
+        pass
+    
+    # PMCID is usually shown in the "Full text links" section or as a link to PMC.
+    # Candidate hrefs in priority order, gathered in one round trip: the
+    # "Full text links" section first, then PMC links anywhere on the page
+    for href in page.evaluate(_PMC_LINK_CANDIDATES_JS):
+        pmc_match = _PMC_HREF_RE.search(href)
+        if pmc_match:
+            return f"PMC{pmc_match.group(1)}", _pmc_url(href)
+    
+    # Alternative: Look for PMCID in the page metadata or visible text
+    try:
+        pmc_match = _PMC_TEXT_RE.search(page.evaluate(_PMCID_TEXT_JS))
+    except Exception:
+        pmc_match = None
+    if pmc_match:
+        pmc_id = f"PMC{pmc_match.group(1)}"
+        return pmc_id, f"{PMC_BASE_URL}/articles/{pmc_id}/"
+    return None, None
+
+
+def _find_pubmed_pdf_links(pool, search_term: str, k: int, cache=None):
+    """
+    Search PubMed in the browser and resolve each hit's PMC article and PDF link.
+    
+    Runs as separate passes, each over the whole result list: read the PMIDs off the
+    search page, map them all to PMCIDs in batched ID converter requests, then open the
+    PubMed page of only those PMIDs the API couldn't map. The PDFs are fetched
+    afterwards, concurrently, by the caller.
+    
+    Args:
+        pool: ContextPool to take pages from
+        search_term: The search term
+        k: Number of PubMed results to resolve
+        cache: Optional JsonCache holding PMID -> PMCID mappings from earlier runs
+    
+    Returns:
+        List of (pmc_id, pmc_link, pdf_link) for every result with a PMC copy
+    """
+    # Pass 1: PMIDs from the search results page
+    pmids = _search_pubmed_pmids(pool.page(), search_term, k)
+    if not pmids:
+        return []
+    logger.info("Found %d PubMed result(s) to process", len(pmids))
+    
+    # Pass 2: the ID converter maps up to 200 PMIDs per call, so the PubMed page is
+    # only opened for PMIDs it has no mapping for
+    try:
+        pmcid_map = _pmids_to_pmcids(_SESSION, pmids, ncbi_identity(), cache)
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.warning("ID converter lookup failed (%s); reading PMCIDs from the PubMed pages", e)
+        pmcid_map = {}
+    pmc_links = {pmid: f"{PMC_BASE_URL}/articles/{pmc_id}/" for pmid, pmc_id in pmcid_map.items()}
+    
+    # Pass 3: scrape the PubMed pages of the unmapped PMIDs
+    unmapped = [pmid for pmid in pmids if pmid not in pmcid_map]
+    for i, pmid in enumerate(unmapped, 1):
+        pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+        logger.info("\n[%d/%d] Looking up PMCID on PubMed: %s", i, len(unmapped), pubmed_url)
+        try:
+            # A fresh page per article lets the pool recycle its context
+            pmc_id, pmc_link = _scrape_pmcid(pool.page(), pubmed_url)
         except Exception as e:
-            print(f"Error during search/download process: {e}")
-        finally:
-            browser.close()
+            logger.warning("  ✗ Error processing PubMed result %s: %s", pmid, e)
+            continue
+        if not pmc_id:
+            logger.warning("  ✗ Could not find PMCID for PMID %s - skipping (may not be available in PMC)", pmid)
+            continue
+        logger.info("  Found PMCID: %s", pmc_id)
+        pmcid_map[pmid] = pmc_id
+        pmc_links[pmid] = pmc_link
+        if cache is not None:
+            # Scraped mappings are as permanent as the ID converter's
+            cache.set(f"pmid|{pmid}", pmc_id, expire=PMCID_CACHE_TTL)
     
-    print(f"\n✓ Download complete! {len(downloaded_files)} file(s) downloaded to {download_dir}/")
-    return downloaded_files
+    # PMC redirects /articles/{PMC_ID}/pdf/ to the PDF itself, so the article page
+    # never needs to be opened. Results keep PubMed's order.
+    pending = []
+    # Distinct PMIDs can share a PMC copy; each PDF is only downloaded once
+    seen_pmc_ids = set()
+    for pmid in pmids:
+        pmc_id = pmcid_map.get(pmid)
+        if pmc_id is None or pmc_id in seen_pmc_ids:
+            continue
+        seen_pmc_ids.add(pmc_id)
+        pending.append((pmc_id, pmc_links[pmid], f"{PMC_BASE_URL}/articles/{pmc_id}/pdf/"))
+    return pending
 
 
-def download_pubmed_free_fulltext_papers(search_term: str, k: int = 5, download_dir: str = "downloads", headless: bool = True):
+@_flushes_log
+def download_pubmed_free_fulltext_papers(search_term: str, k: int = 5, download_dir: str = "downloads", headless: bool = True,
+                                         browser=None, click_to_download: bool = False, max_workers: int = 4,
+                                         storage_state_path: str = None):
     """
     Search PubMed and download PDFs from PMC.
     
     Workflow:
     1. Search PubMed with the search term
     2. Extract PubMed links (PMID) for each paper
-    3. Navigate to each PubMed page to get the PMCID
-    4. Navigate to PMC article page using the PMCID
-    5. Download the PDF from PMC
+    3. Map all PMIDs to PMCIDs with one NCBI ID converter request, opening the PubMed
+       page only for PMIDs the API has no mapping for
+    4. Download the PDFs from PMC in parallel, via the Open Access service's direct link
+       or PMC's /articles/{PMCID}/pdf/ redirect, without opening the article pages
+    
+    The PDF links found in steps 1-3 are cached for a day in download_dir/.cache, so
+    repeating a search skips the browser work and goes straight to step 4. PMID -> PMCID
+    mappings are kept there for a week, so new searches only look up unseen PMIDs.
     
     Args:
         search_term: The search term (e.g., "probiotics oral health")
         k: Number of top papers to download (default: 5)
         download_dir: Directory to save downloaded PDFs (default: "downloads")
         headless: Whether to run browser in headless mode (default: True)
+        browser: Optional Browser from launch_browser() to reuse across calls.
+                 A private browser is launched and closed when omitted. Pages come
+                 from a ContextPool, so the context is recycled every 20 pages.
+        click_to_download: If True, a PDF that can't be fetched directly is finally
+                           tried by clicking its link on the article page (default: False)
+        max_workers: Number of PDFs fetched concurrently over HTTPS (default: 4)
+        storage_state_path: Optional JSON file to load the browser's cookies and local
+                            storage from and save them back to, so sessions carry over
+                            between runs (default: None, nothing is persisted)
     
     Returns:
         List of downloaded file paths
     """
-    # Create download directory if it doesn't exist
+    # Create download directory (and any missing parents) once up front
     download_path = Path(download_dir)
-    download_path.mkdir(exist_ok=True)
-    
-    # Construct PubMed search URL
-    encoded_term = urllib.parse.quote(search_term)
-    search_url = f"https://pubmed.ncbi.nlm.nih.gov/?term={encoded_term}"
+    download_path.mkdir(parents=True, exist_ok=True)
     
     downloaded_files = []
     
-    with sync_playwright() as p:
-        # Launch browser
-        browser = p.chromium.launch(headless=headless)
-        context = browser.new_context(
-            accept_downloads=True,
-            viewport={"width": 1920, "height": 1080},
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            extra_http_headers={
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "none",
-                "Sec-Fetch-User": "?1",
-            }
-        )
-        page = context.new_page()
-        
+    # Warm runs reuse the resolved links and skip the browser search entirely
+    cache = JsonCache(download_path / ".cache" / "resolved.json")
+    cache_key = f"pubmed|{search_term}|{k}"
+    
+    with ContextPool(browser, headless, storage_state_path=storage_state_path) as pool:
         try:
-            print(f"Searching PubMed for: {search_term}")
-            print(f"Search URL: {search_url}")
-            print("Navigating to PubMed...")
-            
-            # Navigate to PubMed search results
-            try:
-                page.goto(search_url, wait_until="networkidle", timeout=15000)
-            except Exception as nav_error:
-                print(f"Navigation timeout, trying with load state...")
-                page.goto(search_url, wait_until="load", timeout=15000)
-            time.sleep(3)  # Wait for page to fully load
-            print(f"Page loaded. Title: {page.title()}")
-            print(f"Current URL: {page.url}")
+            pending = cache.get(cache_key)
+            if pending is not None:
+                logger.info("Using cached PubMed results for: %s", search_term)
+            else:
+                pending = _find_pubmed_pdf_links(pool, search_term, k, cache)
+                if pending:
+                    cache.set(cache_key, pending, expire=SEARCH_CACHE_TTL)
             
-            # Wait for results to load - look for result items
-            try:
-                page.wait_for_selector('.docsum-content, .rprt, article, [class*="result"]', timeout=10000)
-            except:
-                print("Warning: Results may not have loaded completely")
-            
-            # Find all PubMed result links (PMID links)
-            # PubMed result links typically look like: /28390121/ or https://pubmed.ncbi.nlm.nih.gov/28390121/
-            pubmed_links = []
-            
-            # Try multiple selectors to find result links - updated for current PubMed structure
-            selectors = [
-                '.docsum-title a',  # Most common selector for PubMed results
-                'a.docsum-title',   # Alternative class format
-                '.rprt a',          # Alternative result format
-                'article a',        # Article tag links
-                'a[href*="/pubmed/"]',  # Links containing /pubmed/
-                'a[href^="/"]',     # Any link starting with /
-            ]
-            
-            for selector in selectors:
+            # PDF downloads are independent GETs, so overlap them on a small pool
+            def _fetch(item):
+                pmc_id = item[0]
                 try:
-                    links = page.query_selector_all(selector)
-                    if links:
-                        print(f"Found {len(links)} links with selector: {selector}")
-                        for link in links:
-                            href = link.get_attribute('href')
-                            if href:
-                                # Extract PMID from various URL patterns
-                                # Patterns: /28390121/, /pubmed/28390121/, https://pubmed.ncbi.nlm.nih.gov/28390121/
-                                pmid_match = re.search(r'/(\d{6,})/?$', href) or re.search(r'pubmed[^/]*/(\d{6,})', href)
-                                if pmid_match:
-                                    pmid = pmid_match.group(1)
-                                    pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-                                    if pubmed_url not in pubmed_links:
-                                        pubmed_links.append(pubmed_url)
-                        if pubmed_links:
-                            print(f"Successfully extracted {len(pubmed_links)} PubMed links")
-                            break
-                except Exception as e:
-                    continue
+                    return _download_pdf_http(_SESSION, pmc_id, download_path)
+                except (requests.RequestException, OSError):
+                    # Left to the browser fallback below; an escaping error would lose
+                    # every PDF already saved in this call
+                    return None
             
-            # Alternative method: look for any links with numeric IDs that match PMID pattern
-            if not pubmed_links:
-                print("Trying alternative method to find PubMed links...")
-                all_links = page.query_selector_all('a[href]')
-                print(f"Found {len(all_links)} total links on page")
-                for link in all_links:
-                    href = link.get_attribute('href')
-                    if href:
-                        # Look for patterns like /12345678/ or /pubmed/12345678/ or pubmed.ncbi.nlm.nih.gov/12345678/
-                        # PMIDs are typically 6-8 digits
-                        pmid_match = re.search(r'/(\d{6,})/?$', href) or re.search(r'pubmed[^/]*/(\d{6,})', href)
-                        if pmid_match:
-                            pmid = pmid_match.group(1)
-                            # Validate it's a reasonable PMID (not a year or other number)
-                            if len(pmid) >= 6 and len(pmid) <= 8:
-                                pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-                                if pubmed_url not in pubmed_links:
-                                    pubmed_links.append(pubmed_url)
-                                    if len(pubmed_links) >= k * 2:  # Get extra to filter
-                                        break
+            fetched = []
+            if pending:
+                with ThreadPoolExecutor(max_workers=min(len(pending), max_workers)) as executor:
+                    fetched = list(executor.map(_fetch, pending))
             
-            if not pubmed_links:
-                print("No PubMed results found. The page structure might have changed.")
-                print("Page title:", page.title())
-                print("Page URL:", page.url)
-                # Save page for debugging
-                page.screenshot(path="debug_pubmed_search_page.png")
-                # Also save HTML for inspection
-                with open("debug_pubmed_search_page.html", "w", encoding="utf-8") as f:
-                    f.write(page.content())
-                print("Debug files saved: debug_pubmed_search_page.png and debug_pubmed_search_page.html")
-                return downloaded_files
+            for (pmc_id, pmc_link, pdf_link), file_path in zip(pending, fetched):
+                if file_path is None:
+                    # PMC sometimes only serves the PDF to a browser session
+                    file_path = _download_in_browser(
+                        pool.page(), pmc_id, pmc_link, pdf_link, download_path, click=click_to_download
+                    )
+                if file_path:
+                    downloaded_files.append(file_path)
+                    logger.info("  ✓ Downloaded: %s", file_path)
+                else:
+                    logger.warning("  ✗ Could not download PDF for %s", pmc_id)
             
-            # Limit to top k results
-            pubmed_links = pubmed_links[:k]
-            print(f"Found {len(pubmed_links)} PubMed result(s) to process")
-            
-            # Process each PubMed result
-            for i, pubmed_url in enumerate(pubmed_links, 1):
+        except Exception as e:
+            logger.warning("Error during search/download process: %s", e)
+    
+    logger.info("\n✓ Download complete! %d file(s) downloaded to %s/", len(downloaded_files), download_dir)
+    return downloaded_files
+
+
+@_flushes_log
+def download_pmc_and_pubmed_papers(search_term: str, k: int = 5, download_dir: str = "downloads",
+                                   headless: bool = True, browser=None):
+    """
+    Run download_pmc_papers() and download_pubmed_free_fulltext_papers() at the same time.
+    
+    The PMC search needs no browser, so it runs on a background thread while the PubMed
+    search drives the (single) browser on the calling thread, which Playwright's sync API
+    requires. Both share the module's HTTP session and NCBI rate limit. Each source saves
+    into its own subdirectory, with its own cache, so the two never write the same file.
+    
+    Args:
+        search_term: The search term (e.g., "vitamin c")
+        k: Number of top papers to download from each source (default: 5)
+        download_dir: Directory holding the "pmc" and "pubmed" subdirectories the PDFs
+                      are saved in (default: "downloads")
+        headless: Whether to run browser in headless mode (default: True)
+        browser: Optional Browser from launch_browser() for the PubMed search
+    
+    Returns:
+        Tuple of (PMC file paths, PubMed file paths)
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pmc_future = executor.submit(download_pmc_papers, search_term, k, os.path.join(download_dir, "pmc"))
+        pubmed_files = download_pubmed_free_fulltext_papers(
+            search_term, k, os.path.join(download_dir, "pubmed"), headless, browser
+        )
+        return pmc_future.result(), pubmed_files
+
+
+def is_retriable_error(error: Exception) -> bool:
+    """Return True for transient failures (timeouts, dropped connections, 429/5xx) worth retrying."""
+    if isinstance(error, (TimeoutError, requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRIABLE_STATUS_CODES
+    return False
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket that caps how many requests start per second.
+    
+    Callers reserve a token and sleep outside the lock until it is due, so parallel
+    workers queue up fairly instead of thrashing against the server's limit.
+    """
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until the caller may send its next request."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+    
+    def pause(self, seconds: float):
+        """Hold back every caller for at least `seconds`, e.g. after the server answers 429."""
+        with self._lock:
+            self._refill()
+            # A token deficit of seconds * rate makes the next acquire() wait that long
+            self._tokens = min(self._tokens, -seconds * self.rate)
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+# Shared by every thread and every downloader in the process (E-utilities calls, PDF
+# fetches and browser navigations alike), since NCBI enforces its limit per client
+_NCBI_LIMITER = RateLimiter(NCBI_RATE_LIMIT)
+_NCBI_KEYED_LIMITER = RateLimiter(NCBI_RATE_LIMIT_WITH_KEY)
+
+
+def _ncbi_limiter(api_key: str = None):
+    """Return the process-wide limiter for NCBI requests (3 req/s, or 10 req/s with an API key)."""
+    return _NCBI_KEYED_LIMITER if api_key else _NCBI_LIMITER
+
+
+def _retry_after_seconds(value: str):
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds to wait, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _request_with_backoff(session, method: str, url: str, max_retries: int = 5, base: float = 0.5,
+                          cap: float = 30.0, limiter: RateLimiter = None, **kwargs):
+    """
+    Send a request, retrying 429/5xx responses, timeouts and dropped connections.
+    
+    A Retry-After header on the response is honoured up to cap; otherwise the wait is
+    drawn uniformly from [0, min(cap, base * 2 ** attempt)] ("full jitter"), so parallel
+    workers that were throttled together don't retry together. A 429 pauses the
+    limiter itself, holding back every request that shares it.
+    
+    Args:
+        session: requests.Session to send the request with
+        method: HTTP method, e.g. "GET"
+        url: URL to request
+        max_retries: Retries after the first attempt (default: 5)
+        base: Base delay in seconds for the backoff (default: 0.5)
+        cap: Longest backoff delay in seconds (default: 30.0)
+        limiter: Optional RateLimiter to acquire before every attempt
+        **kwargs: Passed through to session.request()
+    
+    Returns:
+        The final response; once retries run out it may still carry a retriable status
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt == max_retries:
+                raise
+            time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+            continue
+        
+        if response.status_code not in RETRIABLE_STATUS_CODES or attempt == max_retries:
+            return response
+        delay = _retry_after_seconds(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = random.uniform(0, min(cap, base * 2 ** attempt))
+        else:
+            # A 429 pauses every worker, so an hour-long or far-future Retry-After
+            # must not stall the whole process
+            delay = min(cap, delay)
+        # Release the connection (and any streamed body) before waiting
+        response.close()
+        if limiter is not None and response.status_code == 429:
+            # The whole client is over the limit, so every worker backs off, not just this one;
+            # the next acquire() above does the waiting
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
+
+class JsonCache:
+    """
+    Small thread-safe key/value cache persisted as a JSON file, with per-entry expiry.
+    
+    Used to remember E-utilities lookups (search results, PMID -> PMCID) across runs.
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data = None
+        self._dir_ready = False
+    
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+    
+    def get(self, key: str):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or (entry["expires"] is not None and entry["expires"] < time.time()):
+            return None
+        return entry["value"]
+    
+    def set(self, key: str, value, expire: float = None):
+        """Store value under key, expiring after `expire` seconds (never if None)."""
+        self.update({key: value}, expire)
+    
+    def update(self, items: dict, expire: float = None):
+        """Store several key/value pairs with a single write to disk."""
+        expires = time.time() + expire if expire else None
+        with self._lock:
+            data = self._load()
+            for key, value in items.items():
+                data[key] = {"value": value, "expires": expires}
+            if not self._dir_ready:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._dir_ready = True
+            # Write to a temp file and swap it in so a crash never leaves a torn cache;
+            # the name is unique per write, so instances sharing the file never collide
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp_path, "x", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_path)
+                raise
+
+
+def create_session(pool_size: int = 20):
+    """
+    Create a pooled HTTP session for NCBI requests.
+    
+    Sharing one session across calls keeps connections to eutils/PMC alive,
+    so repeat requests skip the TCP + TLS handshake. The adapter does no retrying
+    of its own: _request_with_backoff() retries instead, because it can take a
+    rate-limiter token before every attempt and honours HTTP-date Retry-After values.
+    
+    Args:
+        pool_size: Maximum number of connections kept open per host (default: 20)
+    
+    Returns:
+        A configured requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+# Shared by the standalone downloaders; requests sessions are safe for concurrent GETs
+_SESSION = create_session()
+
+
+def ncbi_identity(api_key: str = None, email: str = None, tool: str = NCBI_TOOL):
+    """
+    Build the identification parameters NCBI asks API clients to send.
+    
+    Args:
+        api_key: NCBI API key (default: the NCBI_API_KEY environment variable)
+        email: Contact email (default: the NCBI_EMAIL environment variable)
+        tool: Name of the calling tool (default: "medical_paper_downloader")
+    
+    Returns:
+        Dictionary of query parameters to add to every NCBI API request
+    """
+    api_key = api_key or os.environ.get("NCBI_API_KEY")
+    email = email or os.environ.get("NCBI_EMAIL")
+    identity = {"tool": tool}
+    if api_key:
+        identity["api_key"] = api_key
+    if email:
+        identity["email"] = email
+    return identity
+
+
+def _ncbi_get(session, url: str, params: dict, identity: dict):
+    """GET an NCBI API endpoint under the shared rate limit, identifying the client."""
+    user_agent = f"{identity['tool']}/1.0"
+    if "email" in identity:
+        user_agent += f" (mailto:{identity['email']})"
+    response = _request_with_backoff(
+        session, "GET", url,
+        limiter=_ncbi_limiter(identity.get("api_key")),
+        params={**params, **identity},
+        headers={"User-Agent": user_agent},
+        timeout=30
+    )
+    response.raise_for_status()
+    return response
+
+
+def _esearch(session, db: str, term: str, retmax: int, identity: dict, cache: JsonCache = None):
+    """Run an E-utilities esearch against `db` and return the matching UIDs."""
+    cache_key = f"esearch|{db}|{term}|{retmax}"
+    if cache is not None:
+        ids = cache.get(cache_key)
+        if ids is not None:
+            return ids
+    
+    params = {"db": db, "term": term, "retmax": retmax, "retmode": "json"}
+    response = _ncbi_get(session, f"{EUTILS_URL}/esearch.fcgi", params, identity)
+    ids = response.json()["esearchresult"]["idlist"]
+    if cache is not None:
+        cache.set(cache_key, ids, expire=SEARCH_CACHE_TTL)
+    return ids
+
+
+def _pmids_to_pmcids(session, pmids, identity: dict, cache: JsonCache = None):
+    """
+    Map PMIDs to PMCIDs with as few ID converter calls as possible; PMIDs without a
+    PMC copy are dropped.
+    
+    The ID converter accepts at most IDCONV_MAX_IDS IDs per request, so longer lists
+    are sent in batches of that size.
+    """
+    pmcid_map = {}
+    missing = []
+    for pmid in pmids:
+        # Cached entries hold the PMCID, or "" for PMIDs known to have no PMC copy
+        pmc_id = cache.get(f"pmid|{pmid}") if cache is not None else None
+        if pmc_id is None:
+            missing.append(pmid)
+        elif pmc_id:
+            pmcid_map[pmid] = pmc_id
+    
+    for start in range(0, len(missing), IDCONV_MAX_IDS):
+        batch = missing[start:start + IDCONV_MAX_IDS]
+        response = _ncbi_get(session, IDCONV_URL, {"ids": ",".join(batch), "format": "json"}, identity)
+        # Only PMIDs the response actually reports on are remembered, so an error
+        # answer never marks a whole batch as having no PMC copy
+        answered = {
+            str(record["pmid"]): record.get("pmcid", "")
+            for record in response.json().get("records", [])
+            if record.get("pmid")
+        }
+        if cache is not None and answered:
+            cache.update({f"pmid|{pmid}": pmc_id for pmid, pmc_id in answered.items()}, expire=PMCID_CACHE_TTL)
+        pmcid_map.update((pmid, pmc_id) for pmid, pmc_id in answered.items() if pmc_id)
+    return pmcid_map
+
+
+def _oa_pdf_url(session, pmc_id: str, identity: dict):
+    """
+    Ask the PMC Open Access web service for a direct PDF URL.
+    
+    Returns:
+        An https URL for the PDF, or None if the article has no OA PDF or the lookup failed
+    """
+    try:
+        response = _ncbi_get(session, OA_SERVICE_URL, {"id": pmc_id}, identity)
+        root = ET.fromstring(response.content)
+    except (requests.RequestException, ET.ParseError):
+        return None
+    link = root.find(".//record/link[@format='pdf']")
+    if link is None or not link.get("href"):
+        return None
+    # OA links point at ftp.ncbi.nlm.nih.gov, which serves the same paths over https
+    href = link.get("href")
+    if href.startswith("ftp://"):
+        href = "https://" + href[len("ftp://"):]
+    return href
+
+
+def _download_pdf_http(session, pmc_id: str, download_path: Path, identity: dict = None):
+    """
+    Fetch the PDF for a PMC article over plain HTTPS.
+    
+    The PMC Open Access service is asked for a direct PDF link first. Otherwise PMC
+    redirects /articles/{PMC_ID}/pdf/ to the actual PDF file, so no article page is needed.
+    The body is streamed to disk by _stream_pdf(), never held in memory.
+    
+    Returns:
+        The saved file path, or None if PMC did not return a PDF
+    """
+    identity = identity or ncbi_identity()
+    pdf_url = _oa_pdf_url(session, pmc_id, identity)
+    if pdf_url is None:
+        pdf_url = f"{PMC_BASE_URL}/articles/{pmc_id}/pdf/"
+    return _stream_pdf(session, pdf_url, download_path, f"{pmc_id}.pdf",
+                       limiter=_ncbi_limiter(identity.get("api_key")))
+
+
+# One in-process lock per PMCID; flock alone can't be relied on where fcntl is missing
+_STORE_LOCKS = {}
+_STORE_LOCKS_GUARD = threading.Lock()
+
+
+@contextlib.contextmanager
+def _store_lock(store_path: Path, pmc_id: str):
+    """Serialize work on one PMCID in the shared store across threads and, where fcntl exists, processes."""
+    with _STORE_LOCKS_GUARD:
+        lock = _STORE_LOCKS.setdefault(pmc_id, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+        else:
+            with open(store_path / f"{pmc_id}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
                 try:
-                    print(f"\n[{i}/{len(pubmed_links)}] Processing PubMed: {pubmed_url}")
-                    
-                    # Extract PMID from URL
-                    pmid_match = re.search(r'/(\d+)/?$', pubmed_url)
-                    pmid = pmid_match.group(1) if pmid_match else None
-                    
-                    # Navigate to PubMed page
-                    page.goto(pubmed_url, wait_until="networkidle", timeout=10000)
-                    time.sleep(2)
-                    
-                    # Extract PMCID from the PubMed page
-                    # PMCID is usually shown in the "Full text links" section or as a link to PMC
-                    pmc_id = None
-                    pmc_link = None
-                    
-                    # First, try to find in the "Full text links" section
-                    try:
-                        # Look for the full text links section
-                        fulltext_section = page.query_selector('#full-view-heading, .full-text-links, [id*="full"], [class*="full-text"]')
-                        if fulltext_section:
-                            pmc_links_in_section = fulltext_section.query_selector_all('a[href*="PMC"], a[href*="pmc"]')
-                            for pmc_link_elem in pmc_links_in_section:
-                                href = pmc_link_elem.get_attribute('href')
-                                if href:
-                                    pmc_match = re.search(r'PMC(\d+)', href, re.IGNORECASE)
-                                    if pmc_match:
-                                        pmc_id = f"PMC{pmc_match.group(1)}"
-                                        if href.startswith('/'):
-                                            pmc_link = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                        elif not href.startswith('http'):
-                                            pmc_link = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                        else:
-                                            pmc_link = href
-                                        break
-                    except:
-                        pass
-                    
-                    # Look for PMC links anywhere on the page
-                    if not pmc_id:
-                        pmc_link_selectors = [
-                            'a[href*="/articles/PMC"]',
-                            'a[href*="pmc.ncbi.nlm.nih.gov"]',
-                            'a[href*="PMC"]',
-                            'a:has-text("PMC")',
-                            'a:has-text("Free PMC")',
-                            'a:has-text("PubMed Central")'
-                        ]
-                        
-                        for selector in pmc_link_selectors:
-                            try:
-                                pmc_links = page.query_selector_all(selector)
-                                if pmc_links:
-                                    for pmc_link_elem in pmc_links:
-                                        href = pmc_link_elem.get_attribute('href')
-                                        if href and ('PMC' in href.upper() or '/articles/' in href):
-                                            # Extract PMC ID from URL
-                                            pmc_match = re.search(r'PMC(\d+)', href, re.IGNORECASE)
-                                            if pmc_match:
-                                                pmc_id = f"PMC{pmc_match.group(1)}"
-                                                # Construct full PMC URL
-                                                if href.startswith('/'):
-                                                    pmc_link = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                                elif not href.startswith('http'):
-                                                    pmc_link = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                                else:
-                                                    pmc_link = href
-                                                break
-                                    if pmc_id:
-                                        break
-                            except:
-                                continue
-                    
-                    # Alternative: Look for PMCID in the page text/content
-                    if not pmc_id:
-                        try:
-                            page_content = page.content()
-                            # Look for PMC ID in various formats
-                            pmc_match = re.search(r'PMC(\d{6,})', page_content, re.IGNORECASE)
-                            if pmc_match:
-                                pmc_id = f"PMC{pmc_match.group(1)}"
-                                pmc_link = f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/"
-                        except:
-                            pass
-                    
-                    if not pmc_id:
-                        print(f"  ✗ Could not find PMCID for PMID {pmid} - skipping (may not be available in PMC)")
-                        continue
-                    
-                    print(f"  Found PMCID: {pmc_id}")
-                    print(f"  PMC Link: {pmc_link}")
-                    
-                    # Navigate to PMC article page
-                    page.goto(pmc_link, wait_until="networkidle", timeout=10000)
-                    time.sleep(2)
-                    
-                    # Find PDF link on PMC page
-                    pdf_link = None
-                    
-                    # Look for PDF link with pattern: /articles/{PMC_ID}/pdf/{filename}.pdf
-                    pdf_link_selectors = [
-                        f'a[href*="/articles/{pmc_id}/pdf/"]',
-                        'a[href*="/pdf/"]',
-                        'a:has-text("PDF")',
-                        'a[href$=".pdf"]',
-                        'a[title*="PDF"]'
-                    ]
-                    
-                    for selector in pdf_link_selectors:
-                        pdf_links = page.query_selector_all(selector)
-                        if pdf_links:
-                            for pdf_link_elem in pdf_links:
-                                href = pdf_link_elem.get_attribute('href')
-                                if href and '.pdf' in href:
-                                    # Normalize the href to full URL
-                                    if href.startswith('/'):
-                                        full_href = f"https://pmc.ncbi.nlm.nih.gov{href}"
-                                    elif not href.startswith('http'):
-                                        full_href = f"https://pmc.ncbi.nlm.nih.gov/{href}"
-                                    else:
-                                        full_href = href
-                                    
-                                    # Check if it matches the pattern /articles/{PMC_ID}/pdf/{filename}.pdf
-                                    if f'/articles/{pmc_id}/pdf/' in full_href and full_href.endswith('.pdf'):
-                                        pdf_link = full_href
-                                        break
-                            if pdf_link:
-                                break
-                    
-                    # If PDF link not found, try to construct it
-                    if not pdf_link and pmc_id:
-                        # Look for any PDF link and extract filename
-                        all_pdf_links = page.query_selector_all('a[href*=".pdf"]')
-                        for pdf_link_elem in all_pdf_links:
-                            href = pdf_link_elem.get_attribute('href')
-                            if href and href.endswith('.pdf'):
-                                filename = href.split('/')[-1]
-                                pdf_link = f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/pdf/{filename}"
-                                break
-                    
-                    # Download the PDF
-                    if pdf_link:
-                        try:
-                            print(f"  Found PDF link: {pdf_link}")
-                            
-                            # Extract filename from URL
-                            filename = pdf_link.split('/')[-1]
-                            if not filename.endswith('.pdf'):
-                                filename = f"{pmc_id}.pdf"
-                            
-                            pdf_downloaded = False
-                            
-                            # Method 1: Try to click PDF link
-                            for selector in pdf_link_selectors:
-                                try:
-                                    pdf_element = page.query_selector(selector)
-                                    if pdf_element:
-                                        pdf_element.scroll_into_view_if_needed()
-                                        time.sleep(0.3)
-                                        with page.expect_download(timeout=10000) as download_info:
-                                            pdf_element.click()
-                                        download = download_info.value
-                                        
-                                        suggested_filename = download.suggested_filename
-                                        if suggested_filename and suggested_filename.endswith('.pdf'):
-                                            filename = suggested_filename
-                                        
-                                        file_path = download_path / filename
-                                        download.save_as(file_path)
-                                        downloaded_files.append(str(file_path))
-                                        print(f"  ✓ Downloaded: {file_path}")
-                                        pdf_downloaded = True
-                                        break
-                                except (PlaywrightTimeoutError, Exception):
-                                    continue
-                            
-                            # Method 2: Use request API
-                            if not pdf_downloaded:
-                                try:
-                                    response = context.request.get(
-                                        pdf_link,
-                                        headers={
-                                            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-                                            'Accept': 'application/pdf,application/octet-stream,*/*'
-                                        },
-                                        timeout=10000
-                                    )
-                                    
-                                    if response.ok:
-                                        body = response.body()
-                                        if body.startswith(b'%PDF'):
-                                            file_path = download_path / filename
-                                            with open(file_path, 'wb') as f:
-                                                f.write(body)
-                                            downloaded_files.append(str(file_path))
-                                            print(f"  ✓ Downloaded: {file_path}")
-                                            pdf_downloaded = True
-                                except Exception as req_error:
-                                    pass
-                            
-                            # Method 3: Direct navigation
-                            if not pdf_downloaded:
-                                try:
-                                    with page.expect_download(timeout=10000) as download_info:
-                                        page.goto(pdf_link, wait_until="networkidle", timeout=10000)
-                                    download = download_info.value
-                                    file_path = download_path / filename
-                                    download.save_as(file_path)
-                                    downloaded_files.append(str(file_path))
-                                    print(f"  ✓ Downloaded: {file_path}")
-                                    pdf_downloaded = True
-                                except (PlaywrightTimeoutError, Exception):
-                                    pass
-                            
-                            if not pdf_downloaded:
-                                print(f"  ✗ Could not download PDF for {pmc_id}")
-                        except Exception as e:
-                            print(f"  ✗ Error downloading PDF: {e}")
-                    else:
-                        print(f"  ✗ Could not find PDF link for {pmc_id}")
-                    
-                    # Small delay between downloads
-                    time.sleep(1)
-                    
-                except Exception as e:
-                    print(f"  ✗ Error processing PubMed result {i}: {e}")
-                    continue
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _fetch_into_store(session, pmc_id: str, store_path: Path, identity: dict = None, refresh: bool = False):
+    """
+    Make sure the shared store holds {PMC_ID}.pdf, downloading it at most once.
+    
+    The PDF is downloaded into a temporary directory inside the store and moved into
+    place with os.replace, so readers never see a partial file.
+    
+    Returns:
+        Tuple of (stored path or None if PMC did not return a PDF, whether it was downloaded now)
+    """
+    stored = store_path / f"{pmc_id}.pdf"
+    if stored.exists() and not refresh:
+        return stored, False
+    with _store_lock(store_path, pmc_id):
+        # Another worker may have finished the download while we waited
+        if stored.exists() and not refresh:
+            return stored, False
+        with tempfile.TemporaryDirectory(dir=store_path) as tmp_dir:
+            file_path = _download_pdf_http(session, pmc_id, Path(tmp_dir), identity)
+            if file_path is None:
+                return None, False
+            os.replace(file_path, stored)
+    return stored, True
+
+
+def _link_into(stored: Path, target: Path):
+    """Expose a stored PDF at target via a hard link, falling back to a symlink, then a copy."""
+    tmp_target = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(stored, tmp_target)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(stored, target.parent), tmp_target)
+        except OSError:
+            shutil.copyfile(stored, tmp_target)
+    os.replace(tmp_target, target)
+
+
+@_flushes_log
+def download_pmc_papers_http(search_term: str, k: int = 5, download_dir: str = "downloads", use_pubmed: bool = True,
+                             api_key: str = None, max_workers: int = 4, session=None, cache: JsonCache = None,
+                             skip_existing: bool = True, store_dir: str = None, email: str = None,
+                             tool: str = NCBI_TOOL):
+    """
+    Search NCBI via E-utilities and download the top k papers over HTTPS, without a browser.
+    
+    Workflow:
+    1. Search PubMed (or PMC directly) with esearch
+    2. Map PMIDs to PMCIDs with one ID converter call per 200 PMIDs (PubMed only)
+    3. Resolve each PDF URL with the PMC OA service and fetch the PDFs concurrently
+    
+    Args:
+        search_term: The search term (e.g., "vitamin c")
+        k: Number of top papers to download (default: 5)
+        download_dir: Directory to save downloaded PDFs (default: "downloads")
+        use_pubmed: If True, search PubMed and keep hits with a PMC copy (default: True).
+                   If False, search PMC directly.
+        api_key: Optional NCBI API key; raises the shared rate limit from 3 to 10 req/s
+                 (default: the NCBI_API_KEY environment variable)
+        max_workers: Number of PDFs fetched concurrently (default: 4)
+        session: Optional requests.Session to reuse (see create_session()).
+                 A private session is created and closed when omitted.
+        cache: Optional JsonCache for search results and PMID -> PMCID lookups
+        skip_existing: If True, don't re-fetch papers already saved in download_dir (default: True)
+        store_dir: Optional shared directory holding one {PMCID}.pdf per article. Papers
+                   are downloaded there once and linked into download_dir as {PMCID}.pdf,
+                   so overlapping searches don't fetch the same article twice.
+        email: Contact email sent to NCBI (default: the NCBI_EMAIL environment variable)
+        tool: Tool name sent to NCBI (default: "medical_paper_downloader")
+    
+    Returns:
+        List of downloaded file paths
+    """
+    # Create download directory (and any missing parents) once up front
+    download_path = Path(download_dir)
+    download_path.mkdir(parents=True, exist_ok=True)
+    store_path = Path(store_dir) if store_dir is not None else None
+    if store_path is not None:
+        store_path.mkdir(parents=True, exist_ok=True)
+    
+    downloaded_files = []
+    identity = ncbi_identity(api_key, email, tool)
+    
+    owns_session = session is None
+    if owns_session:
+        session = create_session()
+    
+    try:
+        try:
+            if use_pubmed:
+                logger.info("Searching PubMed (E-utilities) for: %s", search_term)
+                # Get extra PMIDs since not every PubMed result has a PMC copy
+                pmids = _esearch(session, "pubmed", search_term, k * 2, identity, cache)
+                pmcid_map = _pmids_to_pmcids(session, pmids, identity, cache)
+                # dict.fromkeys drops repeats (two PMIDs can share a PMC copy) but keeps
+                # result order, so no PDF is fetched twice by concurrent workers
+                pmc_ids = list(dict.fromkeys(pmcid_map[pmid] for pmid in pmids if pmid in pmcid_map))[:k]
+            else:
+                logger.info("Searching PMC (E-utilities) for: %s", search_term)
+                uids = _esearch(session, "pmc", search_term, k, identity, cache)
+                pmc_ids = list(dict.fromkeys(f"PMC{uid}" for uid in uids))
+        except (requests.RequestException, KeyError, ValueError) as e:
+            # Let transient failures reach the caller so it can retry the search
+            if is_retriable_error(e):
+                raise
+            logger.warning("Error during search: %s", e)
+            return downloaded_files
+        
+        if not pmc_ids:
+            logger.warning("No results found.")
+            return downloaded_files
+        
+        logger.info("Found %d result(s) to process", len(pmc_ids))
+        
+        existing = {entry.name for entry in os.scandir(download_path)} if skip_existing else set()
+        
+        def _fetch_shared(pmc_id):
+            target = download_path / f"{pmc_id}.pdf"
+            if target.name in existing:
+                logger.info("  ✓ Already downloaded: %s", target)
+                return str(target)
+            try:
+                stored, fetched = _fetch_into_store(session, pmc_id, store_path, identity, refresh=not skip_existing)
+                if stored is not None:
+                    _link_into(stored, target)
+            except (requests.RequestException, OSError) as e:
+                logger.warning("  ✗ Error downloading PDF for %s: %s", pmc_id, e)
+                return None
+            if stored is None:
+                logger.warning("  ✗ Could not download PDF for %s", pmc_id)
+                return None
+            logger.info("  ✓ %s: %s", 'Downloaded' if fetched else 'Reused from shared store', target)
+            return str(target)
+        
+        def _fetch(pmc_id):
+            if store_path is not None:
+                return _fetch_shared(pmc_id)
             
-        except Exception as e:
-            print(f"Error during search/download process: {e}")
-        finally:
-            browser.close()
+            # PDF filenames come from PMC's redirect, so reuse the one recorded on a previous run
+            known_filename = (cache.get(f"pdf|{pmc_id}") if cache is not None else None) or f"{pmc_id}.pdf"
+            if known_filename in existing:
+                file_path = str(download_path / known_filename)
+                logger.info("  ✓ Already downloaded: %s", file_path)
+                return file_path
+            
+            try:
+                file_path = _download_pdf_http(session, pmc_id, download_path, identity)
+            except (requests.RequestException, OSError) as e:
+                logger.warning("  ✗ Error downloading PDF for %s: %s", pmc_id, e)
+                return None
+            if file_path:
+                if cache is not None:
+                    cache.set(f"pdf|{pmc_id}", os.path.basename(file_path))
+                logger.info("  ✓ Downloaded: %s", file_path)
+            else:
+                logger.warning("  ✗ Could not download PDF for %s", pmc_id)
+            return file_path
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            downloaded_files = [path for path in executor.map(_fetch, pmc_ids) if path]
+    finally:
+        if owns_session:
+            session.close()
     
-    print(f"\n✓ Download complete! {len(downloaded_files)} file(s) downloaded to {download_dir}/")
+    logger.info("\n✓ Download complete! %d file(s) downloaded to %s/", len(downloaded_files), download_dir)
     return downloaded_files
 
 
 if __name__ == "__main__":
     # Example usage
-    import sys
-    
     if len(sys.argv) < 2:
         print("Usage: python paper_downloader.py <search_term> [k] [download_dir]")
         print("Example: python paper_downloader.py 'vitamin c' 5")
@@ -0,0 +1,142 @@
+"""
+Regression tests for paper_downloader._stream_pdf, run against a mocked session so no
+network is needed:
+
+    python -m unittest discover tests
+"""
+import os
+import stat
+import sys
+import tempfile
+import tracemalloc
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import paper_downloader  # noqa: E402
+
+
+PDF_URL = "https://example.org/articles/PMC1/pdf/paper.pdf"
+
+
+class FakeResponse:
+    """The slice of requests.Response that _stream_pdf uses, with a lazily generated body."""
+    
+    def __init__(self, chunks, url=PDF_URL, status_code=200, headers=None):
+        self._chunks = chunks
+        self.url = url
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {'Content-Type': 'application/pdf'}
+    
+    def iter_content(self, chunk_size=1):
+        return iter(self._chunks)
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+    
+    def request(self, method, url, **kwargs):
+        return self.response
+
+
+def _large_body(size, chunk_size=paper_downloader.DOWNLOAD_CHUNK_SIZE):
+    """Yield size bytes of PDF-looking data without ever holding more than one chunk."""
+    chunk = b'%PDF-1.7\n' + b'x' * (chunk_size - 9)
+    sent = 0
+    while sent < size:
+        piece = chunk[:size - sent]
+        sent += len(piece)
+        yield piece
+
+
+def _failing_body():
+    yield b'%PDF-1.7\n' + b'x' * 1000
+    raise ConnectionError("connection dropped mid-body")
+
+
+class StreamPdfTests(unittest.TestCase):
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+    
+    def _stream(self, response):
+        return paper_downloader._stream_pdf(FakeSession(response), PDF_URL, self.dir, "fallback.pdf")
+    
+    def test_large_body_is_streamed_in_bounded_memory(self):
+        size = 50 * 1024 * 1024
+        response = FakeResponse(_large_body(size),
+                                headers={'Content-Type': 'application/pdf', 'Content-Length': str(size)})
+        
+        tracemalloc.start()
+        try:
+            path = self._stream(response)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        self.assertEqual(path, str(self.dir / "paper.pdf"))
+        self.assertEqual(Path(path).stat().st_size, size)
+        # One chunk plus the write buffer; a 50 MB body must never be held in memory
+        self.assertLess(peak, 4 * 1024 * 1024)
+        self.assertEqual(list(self.dir.glob("*.part")), [])
+    
+    def test_non_pdf_body_is_rejected_without_a_file(self):
+        response = FakeResponse([b'<html>Access denied</html>'], headers={'Content-Type': 'application/pdf'})
+        
+        self.assertIsNone(self._stream(response))
+        self.assertEqual(list(self.dir.iterdir()), [])
+    
+    def test_html_content_type_is_rejected_unread(self):
+        response = FakeResponse([b'%PDF-1.7\n'], headers={'Content-Type': 'text/html; charset=utf-8'})
+        
+        self.assertIsNone(self._stream(response))
+        self.assertEqual(list(self.dir.iterdir()), [])
+    
+    def test_short_body_is_truncated_to_its_real_size(self):
+        body = b'%PDF-1.7\n' + b'x' * 5000
+        response = FakeResponse([body], headers={'Content-Type': 'application/pdf',
+                                                 'Content-Length': str(len(body) * 4)})
+        
+        path = self._stream(response)
+        
+        self.assertEqual(Path(path).read_bytes(), body)
+        self.assertEqual(list(self.dir.glob("*.part")), [])
+    
+    def test_fallback_filename_when_url_has_no_pdf_name(self):
+        response = FakeResponse([b'%PDF-1.7\n'], url="https://example.org/articles/PMC1/pdf/")
+        
+        self.assertEqual(self._stream(response), str(self.dir / "fallback.pdf"))
+    
+    def test_saved_file_respects_the_umask(self):
+        old_umask = os.umask(0o022)
+        try:
+            path = self._stream(FakeResponse([b'%PDF-1.7\n']))
+        finally:
+            os.umask(old_umask)
+        
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o644)
+    
+    def test_interrupted_download_leaves_no_files(self):
+        response = FakeResponse(_failing_body())
+        
+        with self.assertRaises(ConnectionError):
+            self._stream(response)
+        self.assertEqual(list(self.dir.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()